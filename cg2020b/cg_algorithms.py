@@ -5,11 +5,51 @@
 import math
 
 
-def draw_line(p_list, algorithm):
+def unique_pixels(pixels):
+    """像素点去重，保留每个像素点第一次出现的位置
+
+    :param pixels: (list of list of int: [[x_0, y_0], [x_1, y_1], ...]) 像素点坐标列表
+    :return: (list of tuple of int: [(x_0, y_0), (x_1, y_1), ...]) 去重后的像素点坐标列表
+    """
+    result = []
+    seen = set()
+    for p in pixels:
+        p = tuple(p)
+        if p not in seen:
+            seen.add(p)
+            result.append(p)
+    return result
+
+
+def pixel_runs(pixels):
+    """像素点去重后按行合并为水平区段，每段可以用一次切片赋值画出
+
+    :param pixels: (list of list of int: [[x_0, y_0], [x_1, y_1], ...]) 像素点坐标列表
+    :return: (list of tuple of int: [(y, x_start, x_end), ...]) 按y、x排序的区段，包含两端，互不重叠也不相邻
+    """
+    result = []
+    for x, y in sorted(set(map(tuple, pixels)), key=lambda p: (p[1], p[0])):
+        if result and result[-1][0] == y and result[-1][2] == x - 1:
+            result[-1] = (y, result[-1][1], x)
+        else:
+            result.append((y, x, x))
+    return result
+
+
+def _format_pixels(pixels, output):
+    if output == 'unique':
+        return unique_pixels(pixels)
+    elif output == 'runs':
+        return pixel_runs(pixels)
+    return pixels
+
+
+def draw_line(p_list, algorithm, output='pixels'):
     """绘制线段
 
     :param p_list: (list of list of int: [[x0, y0], [x1, y1]]) 线段的起点和终点坐标
     :param algorithm: (string) 绘制使用的算法，包括'DDA'和'Bresenham'，此处的'Naive'仅作为示例，测试时不会出现
+    :param output: (string) 输出形式，'pixels'为原样的像素点列表，'unique'为去重后的像素点列表，'runs'为pixel_runs给出的每行连续区段
     :return: (list of list of int: [[x_0, y_0], [x_1, y_1], [x_2, y_2], ...]) 绘制结果的像素点坐标列表
     """
     x0, y0 = p_list[0]
@@ -27,7 +67,7 @@ def draw_line(p_list, algorithm):
                 result.append((x, int(y0 + k * (x - x0))))
     elif algorithm == 'DDA':
         if x1 == x0 and y1 == y0:
-            return [(x0, y0)]
+            return _format_pixels([(x0, y0)], output)
         length = max(abs(x1 - x0), abs(y1 - y0))
         detax = (x1 - x0) / length
         detay = (y1 - y0) / length
@@ -43,7 +83,7 @@ def draw_line(p_list, algorithm):
         # TODO: this is a bit different from the test sample
         change = 0
         if x1 == x0 and y1 == y0:
-            return [(x0, y0)]
+            return _format_pixels([(x0, y0)], output)
         if abs(x0 - x1) < abs(y0 - y1):
             x0, y0, x1, y1 = y0, x0, y1, x1
             change = 1
@@ -73,134 +113,273 @@ def draw_line(p_list, algorithm):
                 p = p + signy * alpha
             elif p <= 0:
                 p = p + signy * detay2
-    return result
+    return _format_pixels(result, output)
 
 
-def draw_polygon(p_list, algorithm):
+def draw_polygon(p_list, algorithm, output='pixels'):
     """绘制多边形
 
     :param p_list: (list of list of int: [[x0, y0], [x1, y1], [x2, y2], ...]) 多边形的顶点坐标列表
     :param algorithm: (string) 绘制使用的算法，包括'DDA'和'Bresenham'
+    :param output: (string) 输出形式，'pixels'为原样的像素点列表，'unique'为去重后的像素点列表，'runs'为pixel_runs给出的每行连续区段
     :return: (list of list of int: [[x_0, y_0], [x_1, y_1], [x_2, y_2], ...]) 绘制结果的像素点坐标列表
     """
     result = []
     for i in range(len(p_list)):
         line = draw_line([p_list[i - 1], p_list[i]], algorithm)
         result += line
+    return _format_pixels(result, output)
+
+
+def fill_polygon(p_list):
+    """扫描线填充多边形（边表与活性边表），按奇偶规则填充，包含边界上的整点
+
+    每条非水平边覆盖扫描线[y_low, y_high)，交点横坐标用整数分子、分母表示，逐行只加一次增量；
+    水平边和顶点直接作为区段输出，补上半开区间漏掉的边界
+
+    :param p_list: (list of list of int: [[x0, y0], [x1, y1], [x2, y2], ...]) 多边形的顶点坐标列表
+    :return: (list of tuple of int: [(y, x_start, x_end), ...]) 填充结果的水平区段，每段包含两端
+    """
+    result = []
+    edge_table = {}  # y_low -> [当前扫描线上交点横坐标乘dy, dx, dy, y_high]
+    for i in range(len(p_list)):
+        x0, y0 = int(p_list[i - 1][0]), int(p_list[i - 1][1])
+        x1, y1 = int(p_list[i][0]), int(p_list[i][1])
+        result.append((y1, x1, x1))
+        if y0 == y1:
+            result.append((y0, min(x0, x1), max(x0, x1)))
+            continue
+        if y0 > y1:
+            x0, y0, x1, y1 = x1, y1, x0, y0
+        edge_table.setdefault(y0, []).append([x0 * (y1 - y0), x1 - x0, y1 - y0, y1])
+    if len(edge_table) == 0:
+        return result
+    y_min = min(edge_table)
+    y_max = max(edge[3] for edges in edge_table.values() for edge in edges)
+    active = []
+    for y in range(y_min, y_max):
+        active = [edge for edge in active if edge[3] > y] + edge_table.get(y, [])
+        active.sort(key=lambda edge: edge[0] / edge[2])
+        for i in range(0, len(active) - 1, 2):
+            left, right = active[i], active[i + 1]
+            x_start = -(-left[0] // left[2])
+            x_end = right[0] // right[2]
+            if x_start <= x_end:
+                result.append((y, x_start, x_end))
+        for edge in active:
+            edge[0] += edge[1]
     return result
 
 
-def draw_ellipse(p_list):
-    """绘制椭圆（采用中点圆生成算法）
+def _round_half(v):
+    """v / 2四舍六入五成双（与round相同），v为整数"""
+    return (v + ((v >> 1) & 1)) >> 1
+
+
+def ellipse_quadrant(p_list):
+    """中点椭圆算法的整数实现，只计算第一象限
+
+    坐标取两倍，半轴长a = A / 2、b = B / 2为半整数时也是整数；决策参数乘16后为整数，
+    与按浮点数计算的原实现逐步相同
 
     :param p_list: (list of list of int: [[x0, y0], [x1, y1]]) 椭圆的矩形包围框左上角和右下角顶点坐标
-    :return: (list of list of int: [[x_0, y_0], [x_1, y_1], [x_2, y_2], ...]) 绘制结果的像素点坐标列表
+    :return: (tuple) 包围框中心坐标的两倍cx2、cy2，以及第一象限各点相对中心的偏移[(m, n), ...]，按生成顺序排列
     """
-    # TODO: this is a bit different from the test sample
     x0, y0 = p_list[0]
     x1, y1 = p_list[1]
-    if x0 == x1 or y0 == y1:
-        return []
+    cx2, cy2 = x0 + x1, y0 + y1
     result = []
-    change = 0
-    if abs(x1 - x0) < abs(y0 - y1):
-        x0, y0, x1, y1 = y0, x0, y1, x1
-        change = 1
-    deltax = (x1+x0)/2
-    deltay = (y1+y0)/2
-    if change == 1:
-        deltax, deltay = deltay, deltax
-    a = abs(x1 - x0) / 2
-    b = abs(y1 - y0) / 2
-    aa, bb = a*a, b*b
-    toaa, tobb = 2*aa, 2*bb
-    thaa, thbb = 3*aa, 3*bb
-    x, y = 0, round(b)
-    p = bb-aa*b+aa/4
-    alpha = toaa + thbb
-    while aa*y >= bb*x:
-        m, n = x, y
-        if change == 1:
-            m, n = y, x            
-        result.append((round(m+deltax), round(n+deltay)))
-        result.append((round(-m+deltax), round(n+deltay)))
-        result.append((round(m+deltax), round(-n+deltay)))
-        result.append((round(-m+deltax), round(-n+deltay)))
+    if x0 == x1 or y0 == y1:
+        return cx2, cy2, result
+    # 沿长轴方向计算，change为1时交换m、n
+    A, B = abs(x1 - x0), abs(y1 - y0)
+    change = A < B
+    if change:
+        A, B = B, A
+    AA, BB = A * A, B * B
+    x, y = 0, _round_half(B)
+    p = 4 * BB - 2 * AA * B + AA
+    while AA * y >= BB * x:
+        result.append((y, x) if change else (x, y))
         x = x + 1
         if p < 0:
-            p = p+tobb*x+thbb
+            p = p + 8 * BB * x + 12 * BB
         else:
-            p = p+tobb*x-toaa*y+alpha
+            p = p + 8 * BB * x - 8 * AA * y + 8 * AA + 12 * BB
             y = y - 1
-        
-    p = bb*(x+1/2)*(x+1/2)+aa*(y-1)*(y-1)-aa*bb
-    alpha = tobb + thaa
+    p = BB * (2 * x + 1) * (2 * x + 1) + 4 * AA * (y - 1) * (y - 1) - AA * BB
     while y >= 0:
-        m, n = x, y
-        if change == 1:
-            m, n = y, x
-        result.append((round(m+deltax), round(n+deltay)))
-        result.append((round(-m+deltax), round(n+deltay)))
-        result.append((round(m+deltax), round(-n+deltay)))
-        result.append((round(-m+deltax), round(-n+deltay)))
+        result.append((y, x) if change else (x, y))
         y = y - 1
         if p <= 0:
-            p = p+tobb*x-toaa*y+alpha
+            p = p + 8 * BB * x - 8 * AA * y + 8 * BB + 12 * AA
             x = x + 1
         else:
-            p = p-toaa*y+thaa
+            p = p - 8 * AA * y + 12 * AA
+    return cx2, cy2, result
+
+
+def ellipse_bound(p_list):
+    """中点椭圆算法绘制结果的包围盒
+
+    细长椭圆在区域2中x每步都可能加1，像素点可能远远超出p_list给出的矩形包围框，所以按第一象限的实际偏移计算
+
+    :param p_list: (list of list of int: [[x0, y0], [x1, y1]]) 椭圆的矩形包围框左上角和右下角顶点坐标
+    :return: (tuple of int: (x_min, y_min, x_max, y_max)) 像素点的包围盒，没有像素点时为None
+    """
+    cx2, cy2, quadrant = ellipse_quadrant(p_list)
+    if len(quadrant) == 0:
+        return None
+    m = max(offset[0] for offset in quadrant)
+    n = max(offset[1] for offset in quadrant)
+    return _round_half(cx2 - 2 * m), _round_half(cy2 - 2 * n), _round_half(cx2 + 2 * m), _round_half(cy2 + 2 * n)
+
+
+def draw_ellipse(p_list, output='pixels'):
+    """绘制椭圆（采用中点圆生成算法）
+
+    :param p_list: (list of list of int: [[x0, y0], [x1, y1]]) 椭圆的矩形包围框左上角和右下角顶点坐标
+    :param output: (string) 输出形式，'pixels'为原样的像素点列表，'unique'为去重后的像素点列表，'runs'为pixel_runs给出的每行连续区段
+    :return: (list of list of int: [[x_0, y_0], [x_1, y_1], [x_2, y_2], ...]) 绘制结果的像素点坐标列表
+    """
+    # TODO: this is a bit different from the test sample
+    cx2, cy2, quadrant = ellipse_quadrant(p_list)
+    result = []
+    for m, n in quadrant:
+        x_plus, x_minus = _round_half(cx2 + 2 * m), _round_half(cx2 - 2 * m)
+        y_plus, y_minus = _round_half(cy2 + 2 * n), _round_half(cy2 - 2 * n)
+        result.append((x_plus, y_plus))
+        result.append((x_minus, y_plus))
+        result.append((x_plus, y_minus))
+        result.append((x_minus, y_minus))
+    return _format_pixels(result, output)
+
+
+# Bezier曲线自适应细分时，控制点到弦的最大距离（像素），细分的最大深度
+BEZIER_FLATNESS = 0.5
+BEZIER_MAX_DEPTH = 24
+
+
+def _distance_to_segment(point, start, end):
+    x, y = point
+    x0, y0 = start
+    dx, dy = end[0] - x0, end[1] - y0
+    length2 = dx * dx + dy * dy
+    if length2 == 0:
+        return math.hypot(x - x0, y - y0)
+    t = max(0, min(1, ((x - x0) * dx + (y - y0) * dy) / length2))
+    return math.hypot(x - x0 - t * dx, y - y0 - t * dy)
+
+
+def bezier_samples(p_list, flatness):
+    """自适应细分Bezier曲线：用de Casteljau算法在u=0.5处不断二分，
+    直到每段的控制点到首末控制点连线的距离都不超过flatness，返回各段端点
+
+    :param p_list: (list of list of int: [[x0, y0], [x1, y1], [x2, y2], ...]) 曲线的控制点坐标列表
+    :param flatness: (float) 平直度容差（像素）
+    :return: (list of tuple of float: [(x_0, y_0), (x_1, y_1), ...]) 按参数顺序的采样点，首末点即首末控制点
+    """
+    points = [(float(x), float(y)) for x, y in p_list]
+    samples = [points[0]]
+    stack = [(points, 0)]
+    while stack:
+        points, depth = stack.pop()
+        if depth >= BEZIER_MAX_DEPTH or \
+                all(_distance_to_segment(p, points[0], points[-1]) <= flatness for p in points[1:-1]):
+            samples.append(points[-1])
+            continue
+        left, right = [points[0]], [points[-1]]
+        p = points
+        while len(p) > 1:
+            p = [((p[i][0] + p[i + 1][0]) / 2, (p[i][1] + p[i + 1][1]) / 2) for i in range(len(p) - 1)]
+            left.append(p[0])
+            right.append(p[-1])
+        right.reverse()
+        stack.append((right, depth + 1))
+        stack.append((left, depth + 1))
+    return samples
+
+
+# 三次均匀B样条的基矩阵（乘以6），第r行是t^(3-r)项的系数
+B_SPLINE_MATRIX = [[-1, 3, -3, 1],
+                   [3, -6, 3, 0],
+                   [-3, 0, 3, 0],
+                   [1, 4, 1, 0]]
+
+
+def b_spline_samples(p_list):
+    """三次均匀B样条曲线采样：每段由相邻4个控制点和基矩阵得到三次多项式，用前向差分逐点计算，
+    每段的采样数由其Bezier控制多边形的长度决定，使相邻采样点相距不超过一个像素
+
+    :param p_list: (list of list of int: [[x0, y0], [x1, y1], [x2, y2], ...]) 曲线的控制点坐标列表，至少4个
+    :return: (list of tuple of float: [(x_0, y_0), (x_1, y_1), ...]) 按参数顺序的采样点
+    """
+    samples = []
+    for j in range(len(p_list) - 3):
+        seg = p_list[j:j + 4]
+        coef = []
+        for r in range(4):
+            coef.append([sum(B_SPLINE_MATRIX[r][i] * seg[i][axis] for i in range(4)) / 6 for axis in range(2)])
+        a, b, c, d = coef
+        # 该段转换为Bezier曲线后的控制点，控制多边形的长度不小于曲线段长度
+        p0 = d
+        p3 = [a[i] + b[i] + c[i] + d[i] for i in range(2)]
+        p1 = [p0[i] + c[i] / 3 for i in range(2)]
+        p2 = [p3[i] - (3 * a[i] + 2 * b[i] + c[i]) / 3 for i in range(2)]
+        length = math.hypot(p1[0] - p0[0], p1[1] - p0[1]) + math.hypot(p2[0] - p1[0], p2[1] - p1[1]) + \
+            math.hypot(p3[0] - p2[0], p3[1] - p2[1])
+        m = max(1, math.ceil(length))
+        h = 1 / m
+        # f(t) = a*t^3 + b*t^2 + c*t + d 的前向差分
+        f = list(d)
+        d1 = [a[i] * h ** 3 + b[i] * h ** 2 + c[i] * h for i in range(2)]
+        d2 = [6 * a[i] * h ** 3 + 2 * b[i] * h ** 2 for i in range(2)]
+        d3 = [6 * a[i] * h ** 3 for i in range(2)]
+        if j == 0:
+            samples.append((f[0], f[1]))
+        for _ in range(m):
+            for i in range(2):
+                f[i] += d1[i]
+                d1[i] += d2[i]
+                d2[i] += d3[i]
+            samples.append((f[0], f[1]))
+    return samples
+
+
+def _connect_samples(samples):
+    """把采样点取整后依次用DDA直线连接，保证结果连续，且每个像素点只出现一次"""
+    points = [(round(x), round(y)) for x, y in samples]
+    result = [points[0]]
+    seen = {points[0]}
+    for i in range(1, len(points)):
+        x0, y0 = points[i - 1]
+        x1, y1 = points[i]
+        if abs(x1 - x0) <= 1 and abs(y1 - y0) <= 1:
+            line = [points[i]]
+        else:
+            line = draw_line([points[i - 1], points[i]], 'DDA')
+        for p in line:
+            if p not in seen:
+                seen.add(p)
+                result.append(p)
     return result
 
 
-def draw_curve(p_list, algorithm):
+def draw_curve(p_list, algorithm, output='pixels'):
     """绘制曲线
 
     :param p_list: (list of list of int: [[x0, y0], [x1, y1], [x2, y2], ...]) 曲线的控制点坐标列表
     :param algorithm: (string) 绘制使用的算法，包括'Bezier'和'B-spline'（三次均匀B样条曲线，曲线不必经过首末控制点）
+    :param output: (string) 输出形式，'pixels'为原样的像素点列表，'unique'为去重后的像素点列表，'runs'为pixel_runs给出的每行连续区段
     :return: (list of list of int: [[x_0, y_0], [x_1, y_1], [x_2, y_2], ...]) 绘制结果的像素点坐标列表
     """
     result = []
-    n = len(p_list) - 1
     if algorithm == 'Bezier':
-        u = 0
-        p_l = p_list
-        while u <= 1:
-            for r in range(1, n + 1):
-                p_temp = []
-                for i in range(0, n - r + 1):
-                    x_t = p_l[i][0] * (1 - u) + p_l[i + 1][0] * u
-                    y_t = p_l[i][1] * (1 - u) + p_l[i + 1][1] * u
-                    p_temp.append([x_t, y_t])
-                p_l = p_temp
-            result.append((round(p_l[0][0]), round(p_l[0][1])))
-            p_l = p_list
-            u += 0.001
+        result = _connect_samples(bezier_samples(p_list, BEZIER_FLATNESS))
     elif algorithm == 'B-spline':
-        def calculate_B(Bik, k, u, n):
-            if k == 1:
-                return
-            calculate_B(Bik, k - 1, u, n)
-            for i in range(n + 1):
-                Bik[i] = ((u - i) * Bik[i] + (i + k - u) * Bik[i + 1]) / (k - 1)
-            return
-        k = 4
-        u = k - 1
-        while u <= n + 1:
-            sum_list = [0, 0]
-            Bik = []
-            for i in range(n + k + 1):
-                if i <= u and u < (i + 1):
-                    Bik.append(1)
-                else:
-                    Bik.append(0)
-            calculate_B(Bik, k, u, n)
-            for i in range(n + 1):
-                sum_list[0] += p_list[i][0] * Bik[i]
-                sum_list[1] += p_list[i][1] * Bik[i]
-            x, y = sum_list[0], sum_list[1]
-            result.append((round(x), round(y)))
-            u += 0.005
-    return result
+        if len(p_list) >= 4:
+            result = _connect_samples(b_spline_samples(p_list))
+    return _format_pixels(result, output)
 
 
 def translate(p_list, dx, dy):
@@ -351,6 +530,47 @@ def clip(p_list, x_min, y_min, x_max, y_max, algorithm):
     return result
 
 
+def clip_polygon(p_list, x_min, y_min, x_max, y_max):
+    """多边形裁剪（Sutherland-Hodgman算法），依次用窗口的四条边界裁剪，每条边界线性时间
+
+    :param p_list: (list of list of int: [[x0, y0], [x1, y1], [x2, y2], ...]) 多边形的顶点坐标列表
+    :param x_min: 裁剪窗口左上角x坐标
+    :param y_min: 裁剪窗口左上角y坐标
+    :param x_max: 裁剪窗口右下角x坐标
+    :param y_max: 裁剪窗口右下角y坐标
+    :return: (list of list of int: [[x_0, y_0], [x_1, y_1], ...]) 裁剪后多边形的顶点坐标列表，完全在窗口外时为空列表
+    """
+    # 每条边界为(坐标分量, 边界值, 方向)，(p[axis] - bound) * sign >= 0 为窗口内侧
+    boundaries = ((0, x_min, 1), (0, x_max, -1), (1, y_min, 1), (1, y_max, -1))
+    points = [[float(x), float(y)] for x, y in p_list]
+    for axis, bound, sign in boundaries:
+        if len(points) == 0:
+            break
+        result = []
+        prev = points[-1]
+        prev_inside = (prev[axis] - bound) * sign >= 0
+        for cur in points:
+            cur_inside = (cur[axis] - bound) * sign >= 0
+            if cur_inside != prev_inside:
+                t = (bound - prev[axis]) / (cur[axis] - prev[axis])
+                cross = [prev[0] + t * (cur[0] - prev[0]), prev[1] + t * (cur[1] - prev[1])]
+                cross[axis] = bound
+                result.append(cross)
+            if cur_inside:
+                result.append(cur)
+            prev, prev_inside = cur, cur_inside
+        points = result
+    # 取整后去掉相邻的重复顶点
+    result = []
+    for x, y in points:
+        point = [round(x), round(y)]
+        if len(result) == 0 or result[-1] != point:
+            result.append(point)
+    while len(result) > 1 and result[0] == result[-1]:
+        result.pop()
+    return result
+
+
 def draw_curve_point(point):
     result = []
     for i in range(3):
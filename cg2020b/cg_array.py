@@ -0,0 +1,412 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+# 数组后端：与cg_algorithms给出相同的像素点，但以numpy数组批量计算
+# cg_algorithms本身只依赖math库，需要numpy的实现都放在这里
+import numpy as np
+import cg_algorithms as alg
+
+# 分段累加时单块补齐矩阵的最大元素个数，用于限制内存
+_ACCUMULATE_BUDGET = 1 << 22
+
+
+def _segmented_accumulate(values, counts):
+    """按段顺序累加（与Python中逐次 x = x + d 的浮点结果逐位一致）
+
+    :param values: (numpy.ndarray of float) 各段首尾相接的值，每段第一个为初值，其余为增量
+    :param counts: (numpy.ndarray of int) 每段的元素个数
+    :return: (numpy.ndarray of float) 各段的前缀和，首尾相接
+    """
+    total = len(values)
+    result = np.empty(total, np.float64)
+    if total == 0:
+        return result
+    offsets = np.zeros(len(counts), np.int64)
+    np.cumsum(counts[:-1], out=offsets[1:])
+    # 按段长排序后分块，使补齐浪费的空间有界
+    order = np.argsort(counts, kind='stable')
+    begin = 0
+    while begin < len(order):
+        end = begin + 1
+        while end < len(order) and (end - begin + 1) * counts[order[end]] <= _ACCUMULATE_BUDGET:
+            end += 1
+        seg = order[begin:end]
+        seg_counts = counts[seg]
+        width = int(seg_counts.max())
+        rows = np.repeat(np.arange(len(seg)), seg_counts)
+        cols = np.arange(len(rows)) - np.repeat(np.cumsum(seg_counts) - seg_counts, seg_counts)
+        index = np.repeat(offsets[seg], seg_counts) + cols
+        padded = np.zeros((len(seg), width), np.float64)
+        padded[rows, cols] = values[index]
+        np.add.accumulate(padded, axis=1, out=padded)
+        result[index] = padded[rows, cols]
+        begin = end
+    return result
+
+
+def _draw_lines_dda(x0, y0, x1, y1, steps=None):
+    dx, dy = x1 - x0, y1 - y0
+    length = np.maximum(np.abs(dx), np.abs(dy))
+    safe = np.where(length == 0, 1, length)
+    detax = dx / safe
+    detay = dy / safe
+    if steps is not None:
+        # 只计算第k_lo到第k_hi步，直接按k乘增量求坐标；
+        # 精确值恰为.5时取整方向取决于逐次累加的误差，这样的线段标记为不精确
+        k_lo, k_hi = steps
+        counts = k_hi - k_lo + 1
+        start = np.repeat(np.arange(len(counts)), counts)
+        k = k_lo[start] + np.arange(len(start)) - np.repeat(np.cumsum(counts) - counts, counts)
+        xs = x0[start] + k * detax[start]
+        ys = y0[start] + k * detay[start]
+        period = 2 * safe[start]
+        tie = ((2 * k * dx[start] - length[start]) % period == 0) | ((2 * k * dy[start] - length[start]) % period == 0)
+        exact = np.ones(len(counts), np.bool_)
+        exact[start[tie]] = False
+        return np.stack([np.rint(xs), np.rint(ys)], axis=1).astype(np.int64), start, exact
+    counts = length + 1
+    start = np.repeat(np.arange(len(counts)), counts)
+    first = np.zeros(len(start), np.bool_)
+    first[np.cumsum(counts) - counts] = True
+    xs = np.where(first, x0[start], detax[start])
+    ys = np.where(first, y0[start], detay[start])
+    xs = _segmented_accumulate(xs, counts)
+    ys = _segmented_accumulate(ys, counts)
+    return np.stack([np.rint(xs), np.rint(ys)], axis=1).astype(np.int64)
+
+
+def _draw_lines_bresenham(x0, y0, x1, y1, steps=None):
+    origin = np.stack([x0, y0, x1, y1], axis=1)
+    # 与cg_algorithms.draw_line相同的预处理：斜率大于1时交换x、y，再保证x0 <= x1
+    change = np.abs(x0 - x1) < np.abs(y0 - y1)
+    x0, y0, x1, y1 = (np.where(change, y0, x0), np.where(change, x0, y0),
+                      np.where(change, y1, x1), np.where(change, x1, y1))
+    reverse = x0 > x1
+    x0, y0, x1, y1 = (np.where(reverse, x1, x0), np.where(reverse, y1, y0),
+                      np.where(reverse, x0, x1), np.where(reverse, y0, y1))
+    detax, detay = x1 - x0, y1 - y0
+    signy = np.sign(detay)
+
+    # 与原实现完全相同的浮点运算得到初始决策参数p，其与精确整数值的差决定p恰为0时的走向
+    safe = np.where(detax == 0, 1, detax)
+    m = detay / safe
+    b = y0 - m * x0
+    c = 2 * detay + safe * (2 * b - signy)
+    p0 = 2 * detay * x0 - 2 * detax * y0 + c
+    exact_p0 = 2 * detay - detax * signy
+    tie_step = (p0 - exact_p0) > 0
+
+    if steps is None:
+        k_lo = np.zeros(len(detax), np.int64)
+        counts = detax + 1
+    else:
+        # 步数从原起点起算，交换起止点后换算到从新起点起算
+        k_lo = np.where(reverse, detax - steps[1], steps[0])
+        counts = steps[1] - steps[0] + 1
+    start = np.repeat(np.arange(len(counts)), counts)
+    k = k_lo[start] + np.arange(len(start)) - np.repeat(np.cumsum(counts) - counts, counts)
+    dx, ady, s = detax[start], np.abs(detay)[start], signy[start]
+    # signy为1时第k个点的y偏移为ceil((2dy*k - dx) / 2dx)；
+    # signy为-1时原实现的决策参数多了一步偏移，k >= 1时为ceil((2|dy|*(k-2) + dx) / 2dx)
+    num = np.where(s >= 0, 2 * ady * k - dx, 2 * ady * (k - 2) + dx)
+    den = 2 * np.where(dx == 0, 1, dx)
+    offset = np.where(tie_step[start], num // den + 1, -((-num) // den))
+    offset[(s < 0) & (k == 0)] = 0
+    offset[s == 0] = 0
+    x = x0[start] + k
+    y = y0[start] + s * offset
+    pixels = np.where(change[start, None], np.stack([y, x], axis=1), np.stack([x, y], axis=1))
+    if steps is not None:
+        # 决策参数恰为0时的走向取决于浮点累加的误差，这样的线段标记为不精确
+        tie = (num % den == 0) & (s != 0) & ~((s < 0) & (k == 0))
+        exact = np.ones(len(counts), np.bool_)
+        exact[start[tie]] = False
+        return pixels.astype(np.int64), start, exact
+
+    # 用同样的浮点累加重放决策参数序列，确认每一步的取舍与原实现一致，否则该段退回逐点计算
+    step = np.zeros(len(k), np.bool_)
+    step[:-1] = offset[1:] != offset[:-1]
+    last = np.cumsum(counts) - 1
+    alpha = 2 * detay - signy * 2 * detax
+    first = k == 0
+    deltas = np.where(step, s * alpha[start], s * 2 * detay[start])
+    values = np.where(first, p0[start], np.roll(deltas, 1))
+    p = _segmented_accumulate(values.astype(np.float64), counts)
+    mismatch = (p > 0) != step
+    mismatch[last] = False
+    mismatch &= s != 0
+
+    if mismatch.any():
+        bad = set(np.unique(start[mismatch]).tolist())
+        pieces = []
+        begin = np.cumsum(counts) - counts
+        for i in range(len(counts)):
+            if i in bad:
+                p_list = origin[i].reshape(2, 2).tolist()
+                pieces.append(np.array(alg.draw_line(p_list, 'Bresenham'), np.int64).reshape(-1, 2))
+            else:
+                pieces.append(pixels[begin[i]:begin[i] + counts[i]])
+        pixels = np.concatenate(pieces)
+    return pixels.astype(np.int64)
+
+
+def _outcodes(x, y, x_min, y_min, x_max, y_max):
+    codes = np.zeros(len(x), np.int64)
+    codes |= np.where(x < x_min, 1, np.where(x > x_max, 1 << 1, 0))
+    codes |= np.where(y < y_min, 1 << 2, np.where(y > y_max, 1 << 3, 0))
+    return codes
+
+
+def _clip_parameters(x1, y1, x2, y2, x_min, y_min, x_max, y_max):
+    """Liang-Barsky参数：线段落在窗口内的部分为参数[u1, u2]，u1 > u2表示完全在窗口外"""
+    deltax, deltay = x2 - x1, y2 - y1
+    p = np.stack([-deltax, deltax, -deltay, deltay])
+    q = np.stack([x1 - x_min, x_max - x1, y1 - y_min, y_max - y1])
+    r = q / np.where(p == 0, 1, p)
+    u1 = np.max(np.where(p < 0, r, 0), axis=0)
+    u2 = np.min(np.where(p > 0, r, 1), axis=0)
+    u2 = np.where(((p == 0) & (q < 0)).any(axis=0), -1, u2)
+    return u1, u2
+
+
+# 线段像素点到线段本身的最大距离（像素）的上界，裁剪时窗口按此外扩
+_LINE_MARGIN = 2
+
+
+def _draw_lines_in_rect(segments, algorithm, rect):
+    x_min, y_min, x_max, y_max = rect
+    x0, y0 = segments[:, 0, 0], segments[:, 0, 1]
+    x1, y1 = segments[:, 1, 0], segments[:, 1, 1]
+    # 像素点与线段的偏差：DDA不超过半个像素，Bresenham在y递减时决策参数错开两步，可达一个多像素，
+    # 端点都在窗口外同一侧的线段也可能有像素点落进窗口；所以按外扩_LINE_MARGIN个像素的窗口做排除和参数裁剪
+    grown = (x_min - _LINE_MARGIN, y_min - _LINE_MARGIN, x_max + _LINE_MARGIN, y_max + _LINE_MARGIN)
+    inside = (_outcodes(x0, y0, *rect) | _outcodes(x1, y1, *rect)) == 0
+    c0 = _outcodes(x0, y0, *grown)
+    c1 = _outcodes(x1, y1, *grown)
+    partial = np.flatnonzero(((c0 & c1) == 0) & ~inside)
+    pieces = [draw_lines(segments[inside], algorithm)]
+    if len(partial) and algorithm in ('DDA', 'Bresenham'):
+        # 求出线段在外扩窗口内的参数范围，只对相应的几步计算像素点，前后各多算一步容纳取整误差
+        x0, y0, x1, y1 = x0[partial], y0[partial], x1[partial], y1[partial]
+        u1, u2 = _clip_parameters(x0, y0, x1, y1, *grown)
+        visible = u1 <= u2
+        x0, y0, x1, y1, u1, u2 = x0[visible], y0[visible], x1[visible], y1[visible], u1[visible], u2[visible]
+        length = np.maximum(np.abs(x1 - x0), np.abs(y1 - y0))
+        k_lo = np.clip(np.floor(u1 * length).astype(np.int64) - 1, 0, length)
+        k_hi = np.clip(np.ceil(u2 * length).astype(np.int64) + 1, 0, length)
+        draw = _draw_lines_dda if algorithm == 'DDA' else _draw_lines_bresenham
+        pixels, start, exact = draw(x0, y0, x1, y1, (k_lo, k_hi))
+        pieces.append(pixels[exact[start]])
+        # 不精确的线段完整步进一遍，保证与不裁剪时的像素点一致
+        inexact = np.stack([x0, y0, x1, y1], axis=1)[~exact].reshape(-1, 2, 2)
+        pieces.append(draw_lines(inexact, algorithm))
+    elif len(partial):
+        pieces.append(draw_lines(segments[partial], algorithm))
+    pixels = np.concatenate(pieces)
+    return pixels[in_rect(pixels, rect)]
+
+
+def in_rect(pixels, rect):
+    """判断像素点是否落在矩形内
+
+    :param pixels: (numpy.ndarray of int, shape (N, 2)) 像素点坐标
+    :param rect: (tuple of int: (x_min, y_min, x_max, y_max)) 矩形，包含边界
+    :return: (numpy.ndarray of bool, shape (N,)) 每个像素点是否在矩形内
+    """
+    x_min, y_min, x_max, y_max = rect
+    return (pixels[:, 0] >= x_min) & (pixels[:, 0] <= x_max) & \
+           (pixels[:, 1] >= y_min) & (pixels[:, 1] <= y_max)
+
+
+# 椭圆四个象限相对中心的符号，顺序与cg_algorithms.draw_ellipse相同
+_QUADRANT_SIGNS = np.array([[1, 1], [-1, 1], [1, -1], [-1, -1]], np.int64)
+
+
+def draw_ellipse(p_list):
+    """绘制椭圆，整数中点算法只算第一象限，其余三个象限用数组运算对称得到，结果与cg_algorithms.draw_ellipse相同
+
+    :param p_list: (list of list of int: [[x0, y0], [x1, y1]]) 椭圆的矩形包围框左上角和右下角顶点坐标
+    :return: (numpy.ndarray of int, shape (N, 2)) 绘制结果的像素点坐标
+    """
+    cx2, cy2, quadrant = alg.ellipse_quadrant(p_list)
+    offsets = np.array(quadrant, np.int64).reshape(-1, 1, 2)
+    doubled = np.array([cx2, cy2], np.int64) + 2 * offsets * _QUADRANT_SIGNS
+    # 与round相同的四舍六入五成双
+    return ((doubled + ((doubled >> 1) & 1)) >> 1).reshape(-1, 2)
+
+
+def clip_spans(spans, rect):
+    """把水平区段裁剪到矩形内
+
+    :param spans: (numpy.ndarray of int, shape (N, 3)) 水平区段(y, x_start, x_end)，包含两端
+    :param rect: (tuple of int: (x_min, y_min, x_max, y_max)) 矩形，包含边界
+    :return: (numpy.ndarray of int, shape (M, 3)) 与矩形相交的区段，两端截到矩形内
+    """
+    x_min, y_min, x_max, y_max = rect
+    spans = spans[(spans[:, 0] >= y_min) & (spans[:, 0] <= y_max) & (spans[:, 1] <= x_max) & (spans[:, 2] >= x_min)]
+    return np.stack([spans[:, 0], np.maximum(spans[:, 1], x_min), np.minimum(spans[:, 2], x_max)], axis=1)
+
+
+def draw_lines(segments, algorithm, rect=None):
+    """批量绘制线段
+
+    :param segments: (array-like of int, shape (N, 2, 2)) N条线段的起点和终点坐标
+    :param algorithm: (string) 绘制使用的算法，包括'DDA'和'Bresenham'，其他算法逐条交给cg_algorithms计算
+    :param rect: (tuple of int: (x_min, y_min, x_max, y_max)) 只保留落在该矩形内的像素点，None表示不裁剪
+    :return: (numpy.ndarray of int, shape (M, 2)) 按线段顺序首尾相接的像素点坐标，给出rect时不保证顺序
+    """
+    segments = np.asarray(segments, np.int64).reshape(-1, 2, 2)
+    if len(segments) == 0:
+        return np.zeros((0, 2), np.int64)
+    if rect is not None:
+        return _draw_lines_in_rect(segments, algorithm, rect)
+    x0, y0 = segments[:, 0, 0], segments[:, 0, 1]
+    x1, y1 = segments[:, 1, 0], segments[:, 1, 1]
+    if algorithm == 'DDA':
+        return _draw_lines_dda(x0, y0, x1, y1)
+    elif algorithm == 'Bresenham':
+        return _draw_lines_bresenham(x0, y0, x1, y1)
+    pieces = [np.array(alg.draw_line(seg.tolist(), algorithm), np.int64).reshape(-1, 2) for seg in segments]
+    return np.concatenate(pieces)
+
+
+def draw_line(p_list, algorithm, rect=None):
+    """绘制线段，结果与cg_algorithms.draw_line相同
+
+    :param p_list: (list of list of int: [[x0, y0], [x1, y1]]) 线段的起点和终点坐标
+    :param algorithm: (string) 绘制使用的算法，包括'DDA'和'Bresenham'
+    :param rect: (tuple of int: (x_min, y_min, x_max, y_max)) 只保留落在该矩形内的像素点，None表示不裁剪
+    :return: (numpy.ndarray of int, shape (N, 2)) 绘制结果的像素点坐标
+    """
+    return draw_lines([p_list], algorithm, rect)
+
+
+def draw_polygon(p_list, algorithm, rect=None):
+    """绘制多边形，所有边一次批量计算，结果与cg_algorithms.draw_polygon相同
+
+    :param p_list: (list of list of int: [[x0, y0], [x1, y1], [x2, y2], ...]) 多边形的顶点坐标列表
+    :param algorithm: (string) 绘制使用的算法，包括'DDA'和'Bresenham'
+    :param rect: (tuple of int: (x_min, y_min, x_max, y_max)) 只保留落在该矩形内的像素点，None表示不裁剪
+    :return: (numpy.ndarray of int, shape (N, 2)) 绘制结果的像素点坐标
+    """
+    points = np.asarray(p_list, np.int64).reshape(-1, 2)
+    segments = np.stack([np.roll(points, 1, axis=0), points], axis=1)
+    return draw_lines(segments, algorithm, rect)
+
+
+def clip_lines(segments, x_min, y_min, x_max, y_max, algorithm):
+    """批量线段裁剪，结果与cg_algorithms.clip的Liang-Barsky算法相同
+
+    :param segments: (array-like of int, shape (N, 2, 2)) N条线段的起点和终点坐标
+    :param x_min: 裁剪窗口左上角x坐标
+    :param y_min: 裁剪窗口左上角y坐标
+    :param x_max: 裁剪窗口右下角x坐标
+    :param y_max: 裁剪窗口右下角y坐标
+    :param algorithm: (string) 使用的裁剪算法，包括'Cohen-Sutherland'和'Liang-Barsky'
+    :return: (tuple of numpy.ndarray) 保留下来的线段裁剪后的坐标(shape (K, 2, 2))，以及每条线段是否保留(shape (N,))
+    """
+    if algorithm not in ('Cohen-Sutherland', 'Liang-Barsky'):
+        raise ValueError(algorithm)
+    segments = np.asarray(segments, np.int64).reshape(-1, 2, 2)
+    x1, y1 = segments[:, 0, 0], segments[:, 0, 1]
+    x2, y2 = segments[:, 1, 0], segments[:, 1, 1]
+    # 编码完成完全接受和完全拒绝，其余线段用Liang-Barsky参数求交
+    c1 = _outcodes(x1, y1, x_min, y_min, x_max, y_max)
+    c2 = _outcodes(x2, y2, x_min, y_min, x_max, y_max)
+    keep = (c1 & c2) == 0
+    result = segments.copy()
+    partial = np.flatnonzero(keep & ((c1 | c2) != 0))
+    if len(partial):
+        x1, y1, x2, y2 = x1[partial], y1[partial], x2[partial], y2[partial]
+        deltax, deltay = x2 - x1, y2 - y1
+        u1, u2 = _clip_parameters(x1, y1, x2, y2, x_min, y_min, x_max, y_max)
+        keep[partial] = u1 <= u2
+        result[partial] = np.rint(np.stack([x1 + u1 * deltax, y1 + u1 * deltay,
+                                            x1 + u2 * deltax, y1 + u2 * deltay], axis=1)).reshape(-1, 2, 2)
+    return result[keep], keep
+
+
+def translate_matrix(dx, dy):
+    """平移变换的齐次坐标矩阵
+
+    :param dx: (float) 水平方向平移量
+    :param dy: (float) 垂直方向平移量
+    :return: (numpy.ndarray of float, shape (3, 3)) 变换矩阵
+    """
+    return np.array([[1, 0, dx], [0, 1, dy], [0, 0, 1]], np.float64)
+
+
+def rotate_matrix(x, y, r):
+    """旋转变换的齐次坐标矩阵，与cg_algorithms.rotate相同，为屏幕坐标系下的顺时针旋转
+
+    :param x: (float) 旋转中心x坐标
+    :param y: (float) 旋转中心y坐标
+    :param r: (float) 顺时针旋转角度（°）
+    :return: (numpy.ndarray of float, shape (3, 3)) 变换矩阵
+    """
+    cosr = np.cos(r * np.pi / 180)
+    sinr = np.sin(r * np.pi / 180)
+    return np.array([[cosr, -sinr, x - x * cosr + y * sinr],
+                     [sinr, cosr, y - x * sinr - y * cosr],
+                     [0, 0, 1]], np.float64)
+
+
+def scale_matrix(x, y, s):
+    """缩放变换的齐次坐标矩阵
+
+    :param x: (float) 缩放中心x坐标
+    :param y: (float) 缩放中心y坐标
+    :param s: (float) 缩放倍数
+    :return: (numpy.ndarray of float, shape (3, 3)) 变换矩阵
+    """
+    return np.array([[s, 0, (1 - s) * x], [0, s, (1 - s) * y], [0, 0, 1]], np.float64)
+
+
+def compose(*matrices):
+    """把依次进行的若干变换合成为一个矩阵
+
+    :param matrices: (numpy.ndarray of float, shape (3, 3)) 按执行顺序排列的变换矩阵
+    :return: (numpy.ndarray of float, shape (3, 3)) 合成后的变换矩阵
+    """
+    result = np.eye(3)
+    for matrix in matrices:
+        result = matrix @ result
+    return result
+
+
+def transform_points(p_list, matrix):
+    """对一组点做仿射变换，不取整
+
+    :param p_list: (array-like, shape (N, 2)) 点坐标
+    :param matrix: (numpy.ndarray of float, shape (3, 3)) 变换矩阵
+    :return: (numpy.ndarray of float, shape (N, 2)) 变换后的点坐标
+    """
+    points = np.asarray(p_list, np.float64).reshape(-1, 2)
+    return points @ matrix[:2, :2].T + matrix[:2, 2]
+
+
+def transform_items(p_lists, matrices):
+    """对多个图元各自做仿射变换，所有点一次计算
+
+    :param p_lists: (list of array-like) 各图元的控制点坐标
+    :param matrices: (array-like of float, shape (K, 3, 3)) 各图元的变换矩阵
+    :return: (list of numpy.ndarray of float) 各图元变换后的控制点坐标
+    """
+    points = [np.asarray(p_list, np.float64).reshape(-1, 2) for p_list in p_lists]
+    if not points:
+        return []
+    counts = [len(p) for p in points]
+    matrices = np.asarray(matrices, np.float64).reshape(-1, 3, 3)
+    per_point = np.repeat(matrices, counts, axis=0)
+    all_points = np.concatenate(points)
+    result = np.einsum('nij,nj->ni', per_point[:, :2, :2], all_points) + per_point[:, :2, 2]
+    return np.split(result, np.cumsum(counts)[:-1])
+
+
+def round_points(points):
+    """光栅化前把变换后的浮点坐标取整
+
+    :param points: (array-like of float, shape (N, 2)) 点坐标
+    :return: (list of list of int) 取整后的控制点坐标列表
+    """
+    return np.rint(np.asarray(points, np.float64)).astype(np.int64).tolist()
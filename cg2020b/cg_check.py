@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+# 回归检查：比较各种加速路径与cg_algorithms逐点计算的结果，python cg_check.py
+import io
+import os
+import sys
+import random
+import argparse
+import tempfile
+import numpy as np
+import cg_algorithms as alg
+import cg_array
+import cg_cli
+
+
+def _pixel_set(pixels):
+    return set(map(tuple, np.asarray(pixels, np.int64).reshape(-1, 2).tolist()))
+
+
+def _raster_set(raster):
+    """rasterize的结果展开为像素点集合，水平区段展开为其中的每个像素点"""
+    if raster.shape[1] == 3:
+        return {(x, y) for y, x_start, x_end in raster.tolist() for x in range(x_start, x_end + 1)}
+    return _pixel_set(raster)
+
+
+def _render(script, output_dir=None, resume=None, **options):
+    """用cg_cli执行指令脚本
+
+    :param script: (string) 指令文件内容
+    :param output_dir: (string) 保存图像和场景快照的目录，None表示使用临时目录
+    :param resume: (string) 先从该场景快照恢复，只执行快照之后的指令
+    :param options: cg_cli.Interpreter的其他参数
+    :return: (dict) saveCanvas保存的名字到画布数组的映射
+    """
+    if output_dir is None:
+        with tempfile.TemporaryDirectory() as output_dir:
+            return _render(script, output_dir, resume, **options)
+    with cg_cli.Interpreter(output_dir, **options) as interpreter:
+        interpreter.run(io.StringIO(script), None if resume is None else interpreter.load_scene(resume))
+    return {name[:-len('.bmp')]: np.array(cg_cli.Image.open(os.path.join(output_dir, name)))
+            for name in os.listdir(output_dir) if name.endswith('.bmp')}
+
+
+def _random_rect(rng):
+    width, height = rng.randrange(20, 200), rng.randrange(20, 200)
+    return width, height, (0, 0, width - 1, height - 1)
+
+
+def check_clipped_lines(rng, count):
+    """裁剪后光栅化的线段与完整光栅化后再筛选画布内的像素点应相同
+
+    :return: (list of string) 不一致的情形
+    """
+    failures = []
+    cases = [([[103, 13], [100, 50]], 'Bresenham', (0, 0, 99, 79)),
+             ([[20, 90], [138, 80]], 'Bresenham', (0, 0, 147, 79))]
+    for _ in range(count):
+        width, height, rect = _random_rect(rng)
+        p_list = [[rng.randrange(-width // 2, width + width // 2), rng.randrange(-height // 2, height + height // 2)]
+                  for _ in range(2)]
+        cases.append((p_list, rng.choice(['DDA', 'Bresenham', 'Naive']), rect))
+    for p_list, algorithm, rect in cases:
+        pixels = np.array(alg.draw_line(p_list, algorithm), np.int64).reshape(-1, 2)
+        expected = _pixel_set(pixels[cg_array.in_rect(pixels, rect)])
+        if _pixel_set(cg_array.draw_line(p_list, algorithm, rect)) != expected:
+            failures.append('line %s %s in %s' % (p_list, algorithm, rect))
+    return failures
+
+
+def check_culled_ellipses(rng, count):
+    """细长椭圆的像素点超出控制点包围盒时不应被剔除
+
+    :return: (list of string) 不一致的情形
+    """
+    failures = []
+    cases = [([[22, 420], [19, 260]], (0, 0, 299, 249))]
+    for _ in range(count):
+        width, height, rect = _random_rect(rng)
+        x0, y0 = rng.randrange(-width, 2 * width), rng.randrange(-height, 2 * height)
+        if rng.random() < 0.5:
+            p_list = [[x0, y0], [x0 + rng.randrange(-4, 5), rng.randrange(-height, 2 * height)]]
+        else:
+            p_list = [[x0, y0], [rng.randrange(-width, 2 * width), y0 + rng.randrange(-4, 5)]]
+        cases.append((p_list, rect))
+    for p_list, rect in cases:
+        pixels = np.array(alg.draw_ellipse(p_list), np.int64).reshape(-1, 2)
+        expected = _pixel_set(pixels[cg_array.in_rect(pixels, rect)])
+        if _pixel_set(cg_cli.rasterize('ellipse', p_list, '', rect)) != expected:
+            failures.append('ellipse %s in %s' % (p_list, rect))
+    return failures
+
+
+def check_shape_cache(rng, count):
+    """形状缓存的结果（包括平移后命中缓存的结果）应与不经缓存的rasterize相同，且不超出画布
+
+    :return: (list of string) 不一致的情形
+    """
+    failures = []
+    rect = (0, 0, 299, 249)
+    cases = [('ellipse', [[222, 248], [219, 100]], ''), ('ellipse', [[222, 150], [219, 1]], '')]
+    for _ in range(count):
+        x0, y0 = rng.randrange(0, 300), rng.randrange(0, 250)
+        item_type, algorithm = rng.choice([('ellipse', ''), ('polygon', 'Fill'), ('line', 'DDA')])
+        if item_type == 'ellipse':
+            p_list = [[x0, y0], [x0 + rng.randrange(-6, 7), y0 + rng.randrange(-160, 160)]]
+        else:
+            p_list = [[x0, y0]] + [[x0 + rng.randrange(-60, 60), y0 + rng.randrange(-60, 60)] for _ in range(3)]
+            p_list = p_list[:2] if item_type == 'line' else p_list
+        # 同一形状平移若干次，偶数平移让椭圆也能命中缓存
+        for _ in range(3):
+            cases.append((item_type, p_list, algorithm))
+            dx, dy = 2 * rng.randrange(-40, 40), 2 * rng.randrange(-40, 40)
+            p_list = [[x + dx, y + dy] for x, y in p_list]
+    cache = cg_cli.ShapeCache()
+    for item_type, p_list, algorithm in cases:
+        expected = _raster_set(cg_cli.rasterize(item_type, p_list, algorithm, rect))
+        if _raster_set(cache.rasterize(item_type, p_list, algorithm, rect)) != expected:
+            failures.append('%s %s %s in %s' % (item_type, p_list, algorithm, rect))
+
+    # 超出画布底边的椭圆曾在合成时越界，或者绕回画布顶部
+    for p_list in ([[222, 248], [219, 100]], [[222, 150], [219, 1]]):
+        script = 'resetCanvas 300 250\ndrawEllipse e %d %d %d %d\nsaveCanvas a\n' % tuple(p_list[0] + p_list[1])
+        try:
+            canvas = _render(script)['a']
+        except IndexError as e:
+            failures.append('script %r: %r' % (script, e))
+            continue
+        y, x = np.nonzero((canvas != 255).any(axis=2))
+        pixels = np.array(alg.draw_ellipse(p_list), np.int64)
+        if set(zip(x.tolist(), y.tolist())) != _pixel_set(pixels[cg_array.in_rect(pixels, rect)]):
+            failures.append('script %r' % script)
+    return failures
+
+
+def random_script(rng, items=40, saves=4):
+    """生成随机指令脚本，包含部分在画布外的图元、细长椭圆和各种编辑操作
+
+    :param rng: (random.Random) 随机数生成器
+    :param items: (int) 绘制的图元数
+    :param saves: (int) saveCanvas的次数
+    :return: (string) 指令文件内容
+    """
+    width, height = rng.randrange(100, 400), rng.randrange(100, 400)
+    lines = ['resetCanvas %d %d' % (width, height)]
+
+    def point():
+        return '%d %d' % (rng.randrange(-width // 4, width + width // 4), rng.randrange(-height // 4, height + height // 4))
+
+    for i in range(items):
+        if rng.random() < 0.2:
+            lines.append('setColor %d %d %d' % (rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+        kind = rng.randrange(5)
+        if kind == 0:
+            lines.append('drawLine l%d %s %s %s' % (i, point(), point(), rng.choice(['DDA', 'Bresenham'])))
+        elif kind == 1:
+            points = ' '.join(point() for _ in range(rng.randrange(3, 6)))
+            lines.append('drawPolygon p%d %s %s' % (i, points, rng.choice(['DDA', 'Bresenham', 'Fill'])))
+        elif kind == 2:
+            lines.append('drawEllipse e%d %s %s' % (i, point(), point()))
+        elif kind == 3:
+            # 细长椭圆，像素点可能远远超出控制点包围盒
+            x, y = rng.randrange(width), rng.randrange(height)
+            lines.append('drawEllipse e%d %d %d %d %d' % (i, x, y, x + rng.randrange(-4, 5), rng.randrange(-height // 2, height)))
+        else:
+            points = ' '.join(point() for _ in range(rng.randrange(4, 7)))
+            lines.append('drawCurve c%d %s %s' % (i, points, rng.choice(['Bezier', 'B-spline'])))
+        if rng.random() < 0.3:
+            item_id = lines[-1].split(' ')[1]
+            edit = rng.randrange(4)
+            if edit == 0:
+                lines.append('translate %s %d %d' % (item_id, rng.randrange(-50, 50), rng.randrange(-50, 50)))
+            elif edit == 1:
+                lines.append('rotate %s %s %d' % (item_id, point(), rng.randrange(-180, 180)))
+            elif edit == 2:
+                lines.append('scale %s %s %.2f' % (item_id, point(), rng.uniform(0.3, 2)))
+            elif item_id[0] in 'lp':
+                lines.append('clip %s %s %s Liang-Barsky' % (item_id, point(), point()))
+        if rng.random() < saves / items:
+            lines.append('saveCanvas s%d' % i)
+    lines.append('saveCanvas last')
+    return '\n'.join(lines) + '\n'
+
+
+def check_tiled_rendering(rng, count):
+    """分块渲染的画布应与单进程增量更新的画布逐像素相同
+
+    :return: (list of string) 不一致的情形
+    """
+    if cg_cli.shared_memory is None:
+        return []
+    failures = []
+    for i in range(max(count // 500, 3)):
+        script = random_script(rng)
+        serial = _render(script)
+        tiled = _render(script, tile_workers=2, tile_size=64)
+        for name in sorted(serial):
+            if not np.array_equal(serial[name], tiled.get(name)):
+                failures.append('script %d, saveCanvas %s: %d pixels differ' %
+                                (i, name, (serial[name] != tiled[name]).any(axis=2).sum()))
+    return failures
+
+
+def check_scene_snapshots(rng, count):
+    """在变换之后插入saveScene不应改变任何图像，从快照恢复后保存的图像应与完整执行相同
+
+    :return: (list of string) 不一致的情形
+    """
+    failures = []
+    cases = ['resetCanvas 300 300\ndrawPolygon p 60 70 150 60 120 160 DDA\n'
+             'rotate p 103 107 %d\nscale p 100 100 0.7\nrotate p 90 120 %d\nsaveCanvas a\n' % (angle, -angle)
+             for angle in (17, 33, 45, 71)]
+    for _ in range(max(count // 500, 3)):
+        cases.append(random_script(rng))
+    for i, script in enumerate(cases):
+        lines = script.splitlines()
+        edits = [k for k, line in enumerate(lines) if line.split(' ')[0] in ('translate', 'rotate', 'scale')]
+        k = (rng.choice(edits) if edits else rng.randrange(len(lines) - 1)) + 1
+        with_scene = '\n'.join(lines[:k] + ['saveScene snap'] + lines[k:]) + '\n'
+        expected = _render(script)
+        with tempfile.TemporaryDirectory() as output_dir:
+            results = [('saveScene', _render(with_scene, output_dir))]
+            results.append(('resume', _render(with_scene, resume=os.path.join(output_dir, 'snap' + cg_cli.SNAPSHOT_SUFFIX))))
+        for label, images in results:
+            for name in sorted(images):
+                if not np.array_equal(images[name], expected[name]):
+                    failures.append('script %d, %s after line %d, saveCanvas %s: %d pixels differ' %
+                                    (i, label, k, name, (images[name] != expected[name]).any(axis=2).sum()))
+    return failures
+
+
+def check_transform_saves(rng, count):
+    """在变换序列中间插入saveCanvas不应改变之后保存的图像
+
+    :return: (list of string) 不一致的情形
+    """
+    failures = []
+    cases = ['resetCanvas 300 300\ndrawPolygon p 60 70 150 60 120 160 DDA\nrotate p 103 107 %d\n'
+             'scale p 100 100 0.7\nrotate p 90 120 %d\nsaveCanvas last\n' % (angle, -angle)
+             for angle in range(7, 180, 7)]
+    for _ in range(max(count // 500, 3)):
+        cases.append(random_script(rng))
+    for i, script in enumerate(cases):
+        lines = script.splitlines()
+        edits = [k for k, line in enumerate(lines) if line.split(' ')[0] in ('translate', 'rotate', 'scale')]
+        k = (rng.choice(edits) if edits else rng.randrange(len(lines) - 1)) + 1
+        expected = _render(script)['last']
+        for options in ({}, {'tile_workers': 2, 'tile_size': 64}):
+            if options and cg_cli.shared_memory is None:
+                continue
+            images = _render('\n'.join(lines[:k] + ['saveCanvas inserted'] + lines[k:]) + '\n', **options)
+            if not np.array_equal(images['last'], expected):
+                failures.append('script %d, saveCanvas after line %d %s: %d pixels differ' %
+                                (i, k, options, (images['last'] != expected).any(axis=2).sum()))
+    return failures
+
+
+CHECKS = [check_clipped_lines, check_culled_ellipses, check_shape_cache, check_tiled_rendering,
+          check_scene_snapshots, check_transform_saves]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='光栅化加速路径的回归检查')
+    parser.add_argument('-n', '--count', type=int, default=3000, help='每项检查的随机用例数')
+    parser.add_argument('--seed', type=int, default=0, help='随机数种子')
+    args = parser.parse_args(argv)
+    failed = 0
+    for check in CHECKS:
+        failures = check(random.Random(args.seed), args.count)
+        print('%s: %s' % (check.__name__, 'ok' if not failures else '%d failed' % len(failures)))
+        for failure in failures[:10]:
+            print('    ' + failure)
+        failed += len(failures)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
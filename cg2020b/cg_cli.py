@@ -3,123 +3,1057 @@
 
 import sys
 import os
+import time
+import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # Python 3.7没有shared_memory，分块渲染退回单进程
+    shared_memory = None
+from collections import OrderedDict, namedtuple
 import cg_algorithms as alg
+import cg_array
+from cg_scene import ITEM_TYPES, SceneStore, SNAPSHOT_SUFFIX, packed_bounds, save_snapshot, load_snapshot
 import numpy as np
 from PIL import Image
 
+# 像素缓存的默认容量（字节）和淘汰策略
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+CACHE_POLICY = 'lru'
+# 按几何形状缓存光栅化结果的容量（字节）
+SHAPE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# 一次保存中损坏区域的个数超过该值时合并为一个包围盒
+MAX_DAMAGE_RECTS = 16
+# 后台写图像的线程数和最多同时排队的画布快照数
+WRITER_WORKERS = 2
+WRITER_MAX_PENDING = 4
+# 分块渲染时每块的边长（像素）
+TILE_SIZE = 1024
+# 批处理模式下目录中被当作指令文件的扩展名
+BATCH_SUFFIX = '.txt'
 
-if __name__ == '__main__':
-    input_file = sys.argv[1]
-    output_dir = sys.argv[2]
+Instruction = namedtuple('Instruction', ['lineno', 'command', 'args'])
+
+
+def control_bound(p_list, margin=1):
+    """按控制点计算图元的包围盒，除椭圆外，图元的像素点都落在控制点包围盒外扩margin的范围内
+
+    :param p_list: (list of list of int) 图元参数
+    :param margin: (int) 包围盒外扩的像素数，用于容纳取整误差
+    :return: (tuple of int: (x_min, y_min, x_max, y_max)) 包围盒，没有控制点时为None
+    """
+    if len(p_list) == 0:
+        return None
+    points = np.asarray(p_list).reshape(-1, 2)
+    x_min, y_min = np.floor(points.min(axis=0)) - margin
+    x_max, y_max = np.ceil(points.max(axis=0)) + margin
+    return int(x_min), int(y_min), int(x_max), int(y_max)
+
+
+def rasterize(item_type, p_list, algorithm, rect=None):
+    """计算图元的像素点
+
+    :param item_type: (string) 图元类型，'line'、'polygon'、'ellipse'、'curve'
+    :param p_list: (list of list of int) 图元参数
+    :param algorithm: (string) 绘制算法
+    :param rect: (tuple of int: (x_min, y_min, x_max, y_max)) 可见区域，只返回其中的像素点，完全在外面的图元不做光栅化；None表示不裁剪
+    :return: (numpy.ndarray of int) 像素点坐标(shape (N, 2))，填充多边形为水平区段(y, x_start, x_end)(shape (N, 3))
+    """
+    # 细长椭圆的像素点可能远远超出控制点包围盒，要先画出来才知道范围，所以只按控制点剔除其他图元
+    if rect is not None and item_type != 'ellipse':
+        bound = control_bound(p_list)
+        if bound is None or bound[0] > rect[2] or bound[2] < rect[0] or bound[1] > rect[3] or bound[3] < rect[1]:
+            return np.zeros((0, 2), np.int64)
+    if item_type == 'polygon' and algorithm == 'Fill':
+        spans = np.array(alg.fill_polygon(p_list), np.int64).reshape(-1, 3)
+        return spans if rect is None else cg_array.clip_spans(spans, rect)
+    elif item_type == 'line':
+        return cg_array.draw_line(p_list, algorithm, rect)
+    elif item_type == 'polygon':
+        return cg_array.draw_polygon(p_list, algorithm, rect)
+    elif item_type == 'ellipse':
+        pixels = cg_array.draw_ellipse(p_list)
+    elif item_type == 'curve':
+        pixels = alg.draw_curve(p_list, algorithm)
+    else:
+        pixels = []
+    pixels = np.array(pixels, np.int64).reshape(-1, 2)
+    if rect is not None:
+        pixels = pixels[cg_array.in_rect(pixels, rect)]
+    return pixels
+
+
+def clip_raster(raster, rect):
+    """把rasterize的结果裁剪到矩形内
+
+    :param raster: (numpy.ndarray of int) 像素点坐标(shape (N, 2))或水平区段(shape (N, 3))
+    :param rect: (tuple of int: (x_min, y_min, x_max, y_max)) 矩形，包含边界
+    :return: (numpy.ndarray of int) 落在矩形内的部分，形式与raster相同
+    """
+    if raster.shape[1] == 3:
+        return cg_array.clip_spans(raster, rect)
+    return raster[cg_array.in_rect(raster, rect)]
+
+
+def raster_bound(raster):
+    """rasterize结果的包围盒
+
+    :param raster: (numpy.ndarray of int) 像素点坐标(shape (N, 2))或水平区段(shape (N, 3))
+    :return: (tuple of int: (x_min, y_min, x_max, y_max)) 包围盒，没有像素点时为None
+    """
+    if len(raster) == 0:
+        return None
+    if raster.shape[1] == 3:
+        return (int(raster[:, 1].min()), int(raster[:, 0].min()),
+                int(raster[:, 2].max()), int(raster[:, 0].max()))
+    x_min, y_min = raster.min(axis=0)
+    x_max, y_max = raster.max(axis=0)
+    return int(x_min), int(y_min), int(x_max), int(y_max)
+
+
+def composite(canvas, items):
+    """按顺序将图元画到画布上，相邻的同色图元合并为一次下标赋值，水平区段按切片赋值
+
+    :param canvas: (numpy.ndarray of uint8, shape (height, width, 3)) 画布
+    :param items: (iterable of (numpy.ndarray, numpy.ndarray)) 依次为rasterize的结果和颜色
+    """
+    group = []
+    group_color = None
+    for raster, color in items:
+        if group and (raster.shape[1] == 3 or not np.array_equal(color, group_color)):
+            pixels_all = np.concatenate(group)
+            canvas[pixels_all[:, 1], pixels_all[:, 0]] = group_color
+            group = []
+        if raster.shape[1] == 3:
+            for y, x_start, x_end in raster.tolist():
+                canvas[y, x_start:x_end + 1] = color
+            continue
+        group.append(raster)
+        group_color = color
+    if group:
+        pixels_all = np.concatenate(group)
+        canvas[pixels_all[:, 1], pixels_all[:, 0]] = group_color
+
+
+class ShapeCache:
+    """
+    按几何形状缓存光栅化结果（LRU），平移后与已缓存图元重合的图元直接取缓存结果加上偏移量
+
+    键为图元类型、算法和相对某个原点的控制点坐标。只有光栅化结果严格随平移而平移时才按相对坐标取键：
+    中点椭圆是整数运算，但半整数中心按五成双取整，只对偶数平移不变；扫描线填充对任意整数平移不变；
+    DDA、Bresenham和曲线的浮点取整与绝对位置有关，按绝对坐标取键，只有完全重合的图元才能命中
+    """
+
+    def __init__(self, max_bytes=SHAPE_CACHE_MAX_BYTES):
+        """
+
+        :param max_bytes: (int) 缓存像素数组的总字节数上限
+        """
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(item_type, p_list, algorithm):
+        """计算缓存键和原点
+
+        :return: (tuple) 缓存键，以及像素点相对的原点(x, y)
+        """
+        x0, y0 = p_list[0]
+        if item_type == 'ellipse':
+            origin = (x0 - x0 % 2, y0 - y0 % 2)
+        elif item_type == 'polygon' and algorithm == 'Fill':
+            origin = (x0, y0)
+        else:
+            origin = (0, 0)
+        points = tuple((x - origin[0], y - origin[1]) for x, y in p_list)
+        return (item_type, algorithm, points), origin
+
+    def rasterize(self, item_type, p_list, algorithm, rect=None):
+        """与rasterize相同，结果总是裁剪到rect内
+
+        控制点包围盒在rect内的图元按完整的光栅化结果查缓存；部分可见的图元直接裁剪光栅化，不进入缓存。
+        椭圆的像素点可能超出控制点包围盒，裁剪光栅化也要完整地画一遍，所以总是查缓存
+
+        :return: (numpy.ndarray of int) 像素点坐标(shape (N, 2))或水平区段(shape (N, 3))
+        """
+        bound = control_bound(p_list)
+        if bound is None or (rect is not None and item_type != 'ellipse' and
+                             not (bound[0] >= rect[0] and bound[1] >= rect[1] and
+                                  bound[2] <= rect[2] and bound[3] <= rect[3])):
+            return rasterize(item_type, p_list, algorithm, rect)
+        key, origin = self.key(item_type, p_list, algorithm)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            cached, bound = entry
+            pixels = cached + self._offset(cached, origin)
+        else:
+            self.misses += 1
+            pixels = rasterize(item_type, p_list, algorithm)
+            bound = raster_bound(pixels)
+            if bound is not None:
+                bound = (bound[0] - origin[0], bound[1] - origin[1], bound[2] - origin[0], bound[3] - origin[1])
+            if pixels.nbytes <= self.max_bytes:
+                cached = pixels - self._offset(pixels, origin)
+                cached.flags.writeable = False
+                self.entries[key] = (cached, bound)
+                self.nbytes += cached.nbytes
+                while self.nbytes > self.max_bytes:
+                    _, (evicted, _) = self.entries.popitem(last=False)
+                    self.nbytes -= evicted.nbytes
+                    self.evictions += 1
+        # 缓存中同时保存相对原点的像素点包围盒，整个落在rect内时不必逐点裁剪
+        if rect is None or bound is None or (bound[0] + origin[0] >= rect[0] and bound[1] + origin[1] >= rect[1] and
+                                             bound[2] + origin[0] <= rect[2] and bound[3] + origin[1] <= rect[3]):
+            return pixels
+        return clip_raster(pixels, rect)
+
+    @staticmethod
+    def _offset(pixels, origin):
+        if pixels.shape[1] == 3:
+            return np.array([origin[1], origin[0], origin[0]], np.int64)
+        return np.array(origin, np.int64)
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+
+class PixelCache:
+    """
+    图元像素缓存，按图元ID保存光栅化结果，不在缓存中的图元即为需要重新光栅化的脏图元
+    """
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES, policy=CACHE_POLICY, shape_cache=None):
+        """
+
+        :param max_bytes: (int) 缓存像素数组的总字节数上限
+        :param policy: (string) 超出上限时的淘汰策略，'lru'淘汰最久未使用的，'fifo'淘汰最早缓存的
+        :param shape_cache: (ShapeCache) 脏图元重新光栅化前查询的形状缓存，None表示不使用
+        """
+        if policy not in ('lru', 'fifo'):
+            raise ValueError('unknown cache policy: %s' % policy)
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.shape_cache = shape_cache
+        self.entries = OrderedDict()
+        self.nbytes = 0
+
+    def get(self, item_id):
+        pixels = self.entries.get(item_id)
+        if pixels is not None and self.policy == 'lru':
+            self.entries.move_to_end(item_id)
+        return pixels
+
+    def put(self, item_id, pixels):
+        self.invalidate(item_id)
+        if pixels.nbytes > self.max_bytes:
+            return
+        pixels.flags.writeable = False
+        self.entries[item_id] = pixels
+        self.nbytes += pixels.nbytes
+        while self.nbytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+
+    def invalidate(self, item_id):
+        pixels = self.entries.pop(item_id, None)
+        if pixels is not None:
+            self.nbytes -= pixels.nbytes
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+    def rasterize(self, item_id, item_type, p_list, algorithm, rect=None):
+        """取缓存中的像素点，脏图元重新光栅化后放入缓存，同一个缓存中rect应保持不变
+
+        :return: (numpy.ndarray of int, shape (N, 2)) 像素点坐标
+        """
+        pixels = self.get(item_id)
+        if pixels is None:
+            if self.shape_cache is None:
+                pixels = rasterize(item_type, p_list, algorithm, rect)
+            else:
+                pixels = self.shape_cache.rasterize(item_type, p_list, algorithm, rect)
+            self.put(item_id, pixels)
+        return pixels
+
+
+class FrameBuffer:
+    """
+    在多次saveCanvas之间保留的画布，只重绘新增图元和被编辑图元的损坏区域
+    """
+
+    def __init__(self, width, height, pixel_cache):
+        """
+
+        :param width: (int) 画布宽度
+        :param height: (int) 画布高度
+        :param pixel_cache: (PixelCache) 图元像素缓存
+        """
+        self.width = width
+        self.height = height
+        self.pixel_cache = pixel_cache
+        self.canvas = np.zeros([height, width, 3], np.uint8)
+        self.canvas.fill(255)
+        self.bounds = {}  # 已画到画布上的图元的包围盒 (x_min, y_min, x_max, y_max)
+        self.dirty = set()
+
+    def invalidate(self, item_id):
+        """图元被绘制、变换、裁剪或删除后调用"""
+        self.pixel_cache.invalidate(item_id)
+        self.dirty.add(item_id)
+
+    def pixels(self, item_id, item):
+        item_type, p_list, algorithm, _ = item
+        rect = (0, 0, self.width - 1, self.height - 1)
+        return self.pixel_cache.rasterize(item_id, item_type, p_list, algorithm, rect)
+
+    def flush(self, item_dict):
+        """把item_dict的当前状态更新到画布上
+
+        :param item_dict: (SceneStore, TransformedScene or dict) 场景，或图元ID到[item_type, p_list, algorithm, color]的有序字典
+        :return: (numpy.ndarray of uint8, shape (height, width, 3)) 画布
+        """
+        damage = []
+        for item_id in self.dirty:
+            if item_id in self.bounds:
+                damage.append(self.bounds.pop(item_id))
+        self.dirty.clear()
+
+        # 最后一个未改动图元之后的图元都位于最上层，可以直接画上去；中间被编辑的图元按损坏区域重绘
+        ids = list(item_dict)
+        top = len(ids)
+        while top > 0 and ids[top - 1] not in self.bounds:
+            top -= 1
+        for item_id in ids[:top]:
+            if item_id not in self.bounds:
+                pixels = self.pixels(item_id, item_dict[item_id])
+                self.bounds[item_id] = raster_bound(pixels)
+                damage.append(self.bounds[item_id])
+
+        damage = [rect for rect in damage if rect is not None]
+        if len(damage) > MAX_DAMAGE_RECTS:
+            damage = [(min(r[0] for r in damage), min(r[1] for r in damage),
+                       max(r[2] for r in damage), max(r[3] for r in damage))]
+        for rect in damage:
+            self._redraw(rect, ids[:top], item_dict)
+
+        top_items = []
+        for item_id in ids[top:]:
+            item = item_dict[item_id]
+            pixels = self.pixels(item_id, item)
+            self.bounds[item_id] = raster_bound(pixels)
+            top_items.append((pixels, item[3]))
+        composite(self.canvas, top_items)
+        return self.canvas
+
+    def _redraw(self, rect, ids, item_dict):
+        x_min, y_min, x_max, y_max = rect
+        self.canvas[y_min:y_max + 1, x_min:x_max + 1] = 255
+        items = []
+        for item_id in ids:
+            bound = self.bounds[item_id]
+            if bound is None or bound[0] > x_max or bound[2] < x_min or bound[1] > y_max or bound[3] < y_min:
+                continue
+            item = item_dict[item_id]
+            pixels = self.pixels(item_id, item)
+            items.append((clip_raster(pixels, rect), item[3]))
+        composite(self.canvas, items)
+
+
+
+class ImageWriter:
+    """
+    在后台线程池中编码并写出位图，排队的画布快照数有上限，满了之后submit会等待
+    """
+
+    def __init__(self, workers=WRITER_WORKERS, max_pending=WRITER_MAX_PENDING):
+        """
+
+        :param workers: (int) 写图像的线程数
+        :param max_pending: (int) 最多同时存在的未写完的画布快照数
+        """
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.futures = []
+
+    def submit(self, canvas, filepath):
+        """保存画布的快照并交给后台线程写出，调用返回后即可继续修改canvas
+
+        :param canvas: (numpy.ndarray of uint8, shape (height, width, 3)) 画布
+        :param filepath: (string) 位图路径
+        """
+        self.slots.acquire()
+        snapshot = canvas.copy()
+        future = self.executor.submit(self._write, snapshot, filepath)
+        self.futures = [f for f in self.futures if not f.done() or f.exception() is not None]
+        self.futures.append(future)
+
+    def _write(self, snapshot, filepath):
+        try:
+            Image.fromarray(snapshot).save(filepath, 'bmp')
+        finally:
+            self.slots.release()
+
+    def close(self):
+        """等待所有位图写完，有写入失败的则抛出第一个异常"""
+        self.executor.shutdown(wait=True)
+        for future in self.futures:
+            future.result()
+        self.futures = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class TransformedScene:
+    """
+    保存画布时场景的只读视图：有待处理变换的图元给出变换并取整后的控制点副本，场景中的整数控制点和变换矩阵保持不变，
+    所以在变换序列中间插入saveCanvas不会改变之后的图像
+    """
+
+    def __init__(self, scene, transformed_points):
+        """
+
+        :param scene: (SceneStore) 场景
+        :param transformed_points: (dict) 图元ID到变换并取整后的控制点
+        """
+        self.scene = scene
+        self.transformed_points = transformed_points
+
+    def __len__(self):
+        return len(self.scene)
+
+    def __iter__(self):
+        return iter(self.scene)
+
+    def __getitem__(self, item_id):
+        item = self.scene[item_id]
+        p_list = self.transformed_points.get(item_id)
+        if p_list is not None:
+            item[1] = p_list
+        return item
+
+    def values(self):
+        return (self[item_id] for item_id in self)
+
+    @property
+    def algorithms(self):
+        return self.scene.algorithms
+
+    def packed_arrays(self):
+        """与SceneStore.packed_arrays相同，有待处理变换的图元换成变换并取整后的控制点"""
+        arrays = self.scene.packed_arrays()
+        if self.transformed_points:
+            item_ids = list(self.transformed_points)
+            counts = arrays['counts'].astype(np.int64)
+            starts = (np.cumsum(counts) - counts)[self.scene.positions(item_ids)]
+            for start, item_id in zip(starts.tolist(), item_ids):
+                p_list = self.transformed_points[item_id]
+                arrays['points'][start:start + len(p_list)] = p_list
+        return arrays
+
+
+def _share_arrays(arrays):
+    """把数组复制到一块共享内存中
+
+    :param arrays: (dict) 名字到numpy数组的映射
+    :return: (SharedMemory, tuple) 共享内存，以及子进程中用_attach_arrays取出数组的描述
+    """
+    layout = {}
+    size = 0
+    for key, array in arrays.items():
+        layout[key] = (array.dtype.str, array.shape, size)
+        size += array.nbytes + -array.nbytes % 8
+    shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    for key, array in arrays.items():
+        dtype, shape, offset = layout[key]
+        np.ndarray(shape, dtype, buffer=shm.buf, offset=offset)[...] = array
+    return shm, (shm.name, layout)
+
+
+_tile_state = {}
+
+
+def _init_tile_worker():
+    _tile_state.clear()
+    # 形状缓存与具体的保存无关，在各次保存之间保留
+    _tile_state['shape_cache'] = ShapeCache()
+
+
+def _attach_arrays(key, spec):
+    """子进程中取_share_arrays共享的数组，spec指向另一块共享内存时先关闭之前的
+
+    :return: (dict, bool) 名字到数组的映射，以及是否换了一块共享内存
+    """
+    name, layout = spec[:2]
+    current = _tile_state.get(key)
+    if current is not None and current[0] == name:
+        return current[2], False
+    if current is not None:
+        _, shm, arrays = _tile_state.pop(key)
+        arrays.clear()
+        shm.close()
+    shm = shared_memory.SharedMemory(name=name)
+    arrays = {k: np.ndarray(shape, dtype, buffer=shm.buf, offset=offset) for k, (dtype, shape, offset) in layout.items()}
+    _tile_state[key] = (name, shm, arrays)
+    return arrays, True
+
+
+def _tile_scene(scene_spec):
+    scene, changed = _attach_arrays('scene', scene_spec)
+    if changed:
+        # 像素缓存按本次保存中的图元下标取键，换了场景就失效
+        _tile_state['pixel_cache'] = PixelCache(shape_cache=_tile_state['shape_cache'])
+    return scene
+
+
+def _ellipse_bounds(scene_spec, rows):
+    scene = _tile_scene(scene_spec)
+    points, starts = scene['points'], scene['starts']
+    return [alg.ellipse_bound(points[start:start + 2].tolist()) for start in starts[rows].tolist()]
+
+
+def _render_tile(scene_spec, canvas_spec, rect, rows):
+    scene = _tile_scene(scene_spec)
+    algorithms = scene_spec[2]
+    canvas = _attach_arrays('canvas', canvas_spec)[0]['canvas']
+    cache = _tile_state['pixel_cache']
+    height, width = canvas.shape[:2]
+    points, starts, counts = scene['points'], scene['starts'], scene['counts']
+    tile_items = []
+    for i in rows:
+        item_type = ITEM_TYPES[scene['type_codes'][i]]
+        algorithm = algorithms[scene['algorithm_codes'][i]]
+        p_list = points[starts[i]:starts[i] + counts[i]].tolist()
+        pixels = cache.rasterize(i, item_type, p_list, algorithm, (0, 0, width - 1, height - 1))
+        tile_items.append((clip_raster(pixels, rect), scene['colors'][i]))
+    composite(canvas, tile_items)
+
+
+class TileRenderer:
+    """
+    分块渲染，与FrameBuffer接口相同：把画布分块，在常驻的进程池中分别光栅化、合成各块，结果与单进程的FrameBuffer相同
+
+    每次保存把场景的数组复制到共享内存中交给各进程，各进程直接写入共享内存中的画布，块之间互不重叠。
+    图元按包围盒分配到与之相交的块，椭圆的像素点包围盒要走一遍中点算法，在各进程中计算，按图元ID缓存到图元被修改为止
+    """
+
+    def __init__(self, width, height, workers=None, tile_size=TILE_SIZE):
+        """
+
+        :param width: (int) 画布宽度
+        :param height: (int) 画布高度
+        :param workers: (int) 进程数，None表示使用CPU核数
+        :param tile_size: (int) 块的边长
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.tile_size = tile_size
+        self.executor = None
+        self.canvas_shm = None
+        self.canvas_spec = None
+        self.reset(width, height)
+
+    def reset(self, width, height):
+        """换成新的画布尺寸，丢弃缓存的包围盒，进程池保留"""
+        self.width = width
+        self.height = height
+        self.ellipse_bounds = {}  # 椭圆图元ID到像素点包围盒
+
+    def invalidate(self, item_id):
+        """图元被绘制、变换、裁剪或删除后调用"""
+        self.ellipse_bounds.pop(item_id, None)
+
+    def flush(self, item_dict):
+        """渲染item_dict的当前状态
+
+        :param item_dict: (SceneStore or TransformedScene) 场景
+        :return: (numpy.ndarray of uint8, shape (height, width, 3)) 画布
+        """
+        shape = (self.height, self.width, 3)
+        if self.width * self.height == 0:
+            return np.zeros(shape, np.uint8)
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_tile_worker)
+        if self.canvas_spec is None or self.canvas_spec[1]['canvas'][1] != shape:
+            self._free_canvas()
+            self.canvas_shm, self.canvas_spec = _share_arrays({'canvas': np.zeros(shape, np.uint8)})
+        ids = list(item_dict)
+        arrays = item_dict.packed_arrays()
+        counts = arrays['counts'].astype(np.int64)
+        arrays['starts'] = np.cumsum(counts) - counts
+        scene_shm, scene_spec = _share_arrays(arrays)
+        scene_spec += (tuple(item_dict.algorithms),)
+        try:
+            bounds = self._bounds(ids, arrays, scene_spec)
+            tasks = []
+            for y in range(0, self.height, self.tile_size):
+                for x in range(0, self.width, self.tile_size):
+                    rect = (x, y, min(x + self.tile_size, self.width) - 1, min(y + self.tile_size, self.height) - 1)
+                    hit = ((bounds[:, 0] <= rect[2]) & (bounds[:, 2] >= rect[0]) &
+                           (bounds[:, 1] <= rect[3]) & (bounds[:, 3] >= rect[1]))
+                    rows = np.nonzero(hit)[0].tolist()
+                    if rows:
+                        tasks.append((rect, rows))
+            canvas = np.ndarray(shape, np.uint8, buffer=self.canvas_shm.buf)
+            canvas.fill(255)
+            for future in [self.executor.submit(_render_tile, scene_spec, self.canvas_spec, rect, rows)
+                           for rect, rows in tasks]:
+                future.result()
+            result = canvas.copy()
+            del canvas
+        finally:
+            scene_shm.close()
+            scene_shm.unlink()
+        return result
+
+    def _bounds(self, ids, arrays, scene_spec):
+        """每个图元像素点的包围盒：椭圆按中点算法的实际范围，其他图元按控制点包围盒外扩1像素
+
+        :return: (numpy.ndarray of int, shape (N, 4)) 按场景顺序的(x_min, y_min, x_max, y_max)，没有像素点的图元为空盒
+        """
+        bounds = packed_bounds(arrays['counts'], arrays['points'])
+        # 细长椭圆的像素点可能远远超出控制点包围盒，没有缓存的分块交给各进程计算
+        ellipses = np.flatnonzero(arrays['type_codes'] == ITEM_TYPES.index('ellipse')).tolist()
+        missing = [row for row in ellipses if ids[row] not in self.ellipse_bounds]
+        if missing:
+            size = -(-len(missing) // (4 * self.workers))
+            chunks = [missing[i:i + size] for i in range(0, len(missing), size)]
+            futures = [self.executor.submit(_ellipse_bounds, scene_spec, rows) for rows in chunks]
+            for rows, future in zip(chunks, futures):
+                for row, bound in zip(rows, future.result()):
+                    self.ellipse_bounds[ids[row]] = (1, 1, 0, 0) if bound is None else bound
+        if ellipses:
+            bounds[ellipses] = [self.ellipse_bounds[ids[row]] for row in ellipses]
+        return bounds
+
+    def _free_canvas(self):
+        if self.canvas_shm is not None:
+            self.canvas_shm.close()
+            self.canvas_shm.unlink()
+            self.canvas_shm = self.canvas_spec = None
+
+    def close(self):
+        """关闭进程池，释放共享内存中的画布"""
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        self._free_canvas()
+
+
+def parse_instructions(fp, start=1):
+    """逐行读取指令文件，每次只保留一行，生成解析后的指令
+
+    用readline而不是迭代文件对象读取，处理指令时仍可以用fp.tell()得到下一行的位置
+
+    :param fp: (file object) 以文本方式打开的指令文件
+    :param start: (int) 从fp当前位置读到的第一行的行号
+    :return: (generator of Instruction) 依次为行号、指令名、参数列表
+    """
+    for lineno, line in enumerate(iter(fp.readline, ''), start):
+        line = line.strip().split(' ')
+        yield Instruction(lineno, line[0], line[1:])
+
+
+class Interpreter:
+    """
+    指令解释器，保存画布状态，按COMMANDS把每条指令分派给对应的处理函数
+    """
+
+    def __init__(self, output_dir, writer=None, tile_workers=None, tile_size=TILE_SIZE):
+        """
+
+        :param output_dir: (string) 图像保存目录
+        :param writer: (ImageWriter) 后台写图像的线程池，None表示在saveCanvas中直接写出
+        :param tile_workers: (int) 分块渲染的进程数，None表示不分块，在当前进程中增量更新画布
+        :param tile_size: (int) 分块渲染时块的边长
+        """
+        self.output_dir = output_dir
+        self.writer = writer
+        self.tile_workers = tile_workers
+        self.tile_size = tile_size
+        self.scene = SceneStore()
+        self.shape_cache = ShapeCache()
+        self.pixel_cache = PixelCache(shape_cache=self.shape_cache)
+        # 分块渲染的进程池在整个指令文件中保留，Python 3.7没有shared_memory时退回单进程
+        self.tile_renderer = None
+        if tile_workers is not None and shared_memory is not None:
+            self.tile_renderer = TileRenderer(0, 0, tile_workers, tile_size)
+        self.pen_color = np.zeros(3, np.uint8)
+        self.width = 0
+        self.height = 0
+        # 每个图元尚未作用到控制点上的变换矩阵，只在裁剪该图元前才作用到控制点上并取整
+        self.pending_transforms = {}
+        # 有待处理变换的图元变换并取整后的控制点副本，保存画布时用于光栅化，变换矩阵改变时丢弃
+        self.transformed_points = {}
+        self.lineno = 0  # 正在执行的指令行号
+        self.fp = None  # 正在执行的指令文件
+        self.reset_framebuffer()
+
+    def execute(self, instruction):
+        handler = COMMANDS.get(instruction.command)
+        self.lineno = instruction.lineno
+        if handler is not None:
+            handler(self, instruction.args)
+
+    def run(self, fp, resume=None):
+        """执行指令文件
+
+        :param fp: (file object) 以文本方式打开的指令文件
+        :param resume: (tuple of int) 从快照恢复时为load_scene返回的行号和文件位置，直接seek到该位置继续执行；
+            None表示从头执行
+        """
+        start = 1
+        if resume is not None:
+            lineno, offset = resume
+            fp.seek(offset)
+            start = lineno + 1
+        self.fp = fp
+        try:
+            for instruction in parse_instructions(fp, start):
+                self.execute(instruction)
+        finally:
+            self.fp = None
+        self.apply_pending_transforms()
+
+    def load_scene(self, path, mmap=True):
+        """从save_scene保存的快照恢复画布状态
+
+        :param path: (string) 快照路径
+        :param mmap: (bool) 是否用numpy.memmap映射快照中的数组
+        :return: (tuple of int) 快照对应的指令行号，以及指令文件中该行之后的位置
+        """
+        snapshot = load_snapshot(path, mmap)
+        self.width = snapshot.width
+        self.height = snapshot.height
+        self.pen_color = snapshot.pen_color
+        self.scene = snapshot.scene
+        self.pending_transforms = snapshot.pending_transforms
+        self.transformed_points = {}
+        self.reset_framebuffer()
+        return snapshot.lineno, snapshot.offset
+
+    def reset_framebuffer(self):
+        """画布尺寸改变或整个场景被替换后，丢弃画布和缓存的像素点"""
+        self.pixel_cache.clear()
+        if self.tile_renderer is None:
+            self.framebuffer = FrameBuffer(self.width, self.height, self.pixel_cache)
+        else:
+            self.tile_renderer.reset(self.width, self.height)
+            self.framebuffer = self.tile_renderer
+
+    def close(self):
+        if self.tile_renderer is not None:
+            self.tile_renderer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def queue_transform(self, item_id, matrix):
+        """把变换合成到图元的待处理矩阵上，不改动控制点"""
+        if item_id not in self.scene:
+            raise KeyError(item_id)
+        pending = self.pending_transforms.get(item_id)
+        self.pending_transforms[item_id] = matrix if pending is None else cg_array.compose(pending, matrix)
+        self.transformed_points.pop(item_id, None)
+        self.framebuffer.invalidate(item_id)
+
+    def discard_transform(self, item_id):
+        """重绘图元时丢弃其待处理的变换"""
+        self.pending_transforms.pop(item_id, None)
+        self.transformed_points.pop(item_id, None)
+
+    def transformed_scene(self):
+        """把待处理的变换作用到控制点的副本上并取整，新变换的图元一次批量计算，场景中的控制点不变
+
+        :return: (TransformedScene) 用于光栅化的场景视图
+        """
+        item_ids = [item_id for item_id in self.pending_transforms if item_id not in self.transformed_points]
+        if item_ids:
+            matrices = [self.pending_transforms[item_id] for item_id in item_ids]
+            p_lists = [self.scene.get_points(item_id) for item_id in item_ids]
+            for item_id, points in zip(item_ids, cg_array.transform_items(p_lists, matrices)):
+                self.transformed_points[item_id] = cg_array.round_points(points)
+        return TransformedScene(self.scene, self.transformed_points)
+
+    def apply_pending_transforms(self, item_ids=None):
+        """把待处理的变换作用到控制点上并取整，所有图元一次批量计算
+
+        :param item_ids: (list of string) 要处理的图元，None表示全部
+        """
+        if item_ids is None:
+            item_ids = list(self.pending_transforms)
+        item_ids = [item_id for item_id in item_ids if item_id in self.pending_transforms]
+        if not item_ids:
+            return
+        self.transformed_scene()
+        for item_id in item_ids:
+            del self.pending_transforms[item_id]
+            self.scene.set_points(item_id, self.transformed_points.pop(item_id))
+
+    def reset_canvas(self, args):
+        self.width = int(args[0])
+        self.height = int(args[1])
+        self.scene.clear()
+        self.pending_transforms = {}
+        self.transformed_points = {}
+        self.reset_framebuffer()
+
+    def save_canvas(self, args):
+        save_name = args[0]
+        # 光栅化变换后控制点的取整副本，不把取整结果写回控制点，否则插入saveCanvas会改变之后的变换结果
+        canvas = self.framebuffer.flush(self.transformed_scene())
+        filepath = os.path.join(self.output_dir, save_name + '.bmp')
+        if self.writer is None:
+            Image.fromarray(canvas).save(filepath, 'bmp')
+        else:
+            self.writer.submit(canvas, filepath)
+
+    def save_scene(self, args):
+        save_name = args[0]
+        # 待处理的变换原样保存，此时取整会改变之后的变换结果
+        filepath = os.path.join(self.output_dir, save_name + SNAPSHOT_SUFFIX)
+        offset = 0 if self.fp is None else self.fp.tell()
+        save_snapshot(filepath, self.scene, self.width, self.height, self.pen_color, self.lineno, offset,
+                      self.pending_transforms)
+
+    def set_color(self, args):
+        self.pen_color[0] = int(args[0])
+        self.pen_color[1] = int(args[1])
+        self.pen_color[2] = int(args[2])
+
+    def draw_line(self, args):
+        item_id = args[0]
+        x0 = int(args[1])
+        y0 = int(args[2])
+        x1 = int(args[3])
+        y1 = int(args[4])
+        algorithm = args[5]
+        self.scene.add(item_id, 'line', [[x0, y0], [x1, y1]], algorithm, self.pen_color)
+        self.discard_transform(item_id)
+        self.framebuffer.invalidate(item_id)
+
+    def draw_polygon(self, args):
+        item_id = args[0]
+        point_list = []
+        for i in range(1, len(args) - 1, 2):
+            point_list.append([int(args[i]), int(args[i + 1])])
+        algorithm = args[-1]
+        self.scene.add(item_id, 'polygon', point_list, algorithm, self.pen_color)
+        self.discard_transform(item_id)
+        self.framebuffer.invalidate(item_id)
+
+    def draw_ellipse(self, args):
+        item_id = args[0]
+        x0 = int(args[1])
+        y0 = int(args[2])
+        x1 = int(args[3])
+        y1 = int(args[4])
+        self.scene.add(item_id, 'ellipse', [[x0, y0], [x1, y1]], '', self.pen_color)
+        self.discard_transform(item_id)
+        self.framebuffer.invalidate(item_id)
+
+    def draw_curve(self, args):
+        item_id = args[0]
+        point_list = []
+        for i in range(1, len(args) - 1, 2):
+            point_list.append([int(args[i]), int(args[i + 1])])
+        algorithm = args[-1]
+        self.scene.add(item_id, 'curve', point_list, algorithm, self.pen_color)
+        self.discard_transform(item_id)
+        self.framebuffer.invalidate(item_id)
+
+    def translate(self, args):
+        item_id = args[0]
+        dx = int(args[1])
+        dy = int(args[2])
+        self.queue_transform(item_id, cg_array.translate_matrix(dx, dy))
+
+    def rotate(self, args):
+        item_id = args[0]
+        x = int(args[1])
+        y = int(args[2])
+        r = float(args[3])
+        self.queue_transform(item_id, cg_array.rotate_matrix(x, y, r))
+
+    def scale(self, args):
+        item_id = args[0]
+        x = int(args[1])
+        y = int(args[2])
+        s = float(args[3])
+        # TODO: just need to expand the control points? or whole points
+        self.queue_transform(item_id, cg_array.scale_matrix(x, y, s))
+
+    def clip(self, args):
+        item_id = args[0]
+        x_min = int(args[1])
+        y_min = int(args[2])
+        x_max = int(args[3])
+        y_max = int(args[4])
+        algorithm = args[-1]
+        self.apply_pending_transforms([item_id])
+        item_type, p_list, _, _ = self.scene[item_id]
+        if item_type == 'polygon':
+            result_list = alg.clip_polygon(p_list, x_min, y_min, x_max, y_max)
+        else:
+            result_list = alg.clip(p_list, x_min, y_min, x_max, y_max, algorithm)
+        if len(result_list) == 0:
+            self.scene.remove(item_id)
+        else:
+            self.scene.set_points(item_id, result_list)
+        self.framebuffer.invalidate(item_id)
+
+
+# 指令名到处理函数的分派表，未列出的指令（如注释行、空行）直接忽略
+COMMANDS = {
+    'resetCanvas': Interpreter.reset_canvas,
+    'saveCanvas': Interpreter.save_canvas,
+    'saveScene': Interpreter.save_scene,
+    'setColor': Interpreter.set_color,
+    'drawLine': Interpreter.draw_line,
+    'drawPolygon': Interpreter.draw_polygon,
+    'drawEllipse': Interpreter.draw_ellipse,
+    'drawCurve': Interpreter.draw_curve,
+    'translate': Interpreter.translate,
+    'rotate': Interpreter.rotate,
+    'scale': Interpreter.scale,
+    'clip': Interpreter.clip,
+}
+
+
+def run(input_file, output_dir, tile_workers=None, tile_size=TILE_SIZE, resume=None):
+    """执行一个指令文件
+
+    :param input_file: (string) 指令文件路径
+    :param output_dir: (string) 图像保存目录
+    :param tile_workers: (int) 分块渲染的进程数，None表示不分块
+    :param tile_size: (int) 分块渲染时块的边长
+    :param resume: (string) 由该指令文件中的saveScene保存的快照路径，从快照恢复后只执行其后的指令；None表示从头执行
+    :return: (Interpreter) 执行完毕后的解释器，可继续查看画布状态
+    """
     os.makedirs(output_dir, exist_ok=True)
+    with ImageWriter() as writer, open(input_file, 'r') as fp, \
+            Interpreter(output_dir, writer, tile_workers, tile_size) as interpreter:
+        interpreter.run(fp, None if resume is None else interpreter.load_scene(resume))
+    return interpreter
+
+
+def collect_inputs(paths):
+    """展开输入路径，目录按文件名排序取其中的指令文件
+
+    :param paths: (list of string) 指令文件或目录
+    :return: (list of string) 指令文件列表
+    """
+    inputs = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith(BATCH_SUFFIX) and os.path.isfile(os.path.join(path, name)):
+                    inputs.append(os.path.join(path, name))
+        else:
+            inputs.append(path)
+    return inputs
+
+
+def batch_output_dirs(inputs, output_dir):
+    """为每个指令文件分配输出子目录，以文件名（去掉扩展名）命名，重名时依次加上_1、_2等后缀
 
-    item_dict = {}
-    pen_color = np.zeros(3, np.uint8)
-    width = 0
-    height = 0
-
-    with open(input_file, 'r') as fp:
-        line = fp.readline()
-        while line:
-            line = line.strip().split(' ')
-            if line[0] == 'resetCanvas':
-                width = int(line[1])
-                height = int(line[2])
-                item_dict = {}
-            elif line[0] == 'saveCanvas':
-                save_name = line[1]
-                canvas = np.zeros([height, width, 3], np.uint8)
-                canvas.fill(255)
-                for item_type, p_list, algorithm, color in item_dict.values():
-                    if item_type == 'line':
-                        pixels = alg.draw_line(p_list, algorithm)
-                        for x, y in pixels:
-                            canvas[y, x] = color
-                    elif item_type == 'polygon':
-                        pixels = alg.draw_polygon(p_list, algorithm)
-                        for x, y in pixels:
-                            canvas[y, x] = color
-                    elif item_type == 'ellipse':
-                        pixels = alg.draw_ellipse(p_list)
-                        for x, y in pixels:
-                            canvas[y, x] = color
-                    elif item_type == 'curve':
-                        pixels = alg.draw_curve(p_list, algorithm)
-                        for x, y in pixels:
-                            canvas[y, x] = color
-                Image.fromarray(canvas).save(os.path.join(output_dir, save_name + '.bmp'), 'bmp')
-            elif line[0] == 'setColor':
-                pen_color[0] = int(line[1])
-                pen_color[1] = int(line[2])
-                pen_color[2] = int(line[3])
-            elif line[0] == 'drawLine':
-                item_id = line[1]
-                x0 = int(line[2])
-                y0 = int(line[3])
-                x1 = int(line[4])
-                y1 = int(line[5])
-                algorithm = line[6]
-                item_dict[item_id] = ['line', [[x0, y0], [x1, y1]], algorithm, np.array(pen_color)]
-            elif line[0] == 'drawPolygon':
-                item_id = line[1]
-                point_list = []
-                for i in range(2, len(line) - 1, 2):
-                    point_list.append([int(line[i]), int(line[i+1])])
-                algorithm = line[-1]
-                item_dict[item_id] = ['polygon', point_list, algorithm, np.array(pen_color)]
-            elif line[0] == 'drawEllipse':
-                item_id = line[1]
-                x0 = int(line[2])
-                y0 = int(line[3])
-                x1 = int(line[4])
-                y1 = int(line[5])
-                item_dict[item_id] = ['ellipse', [[x0, y0], [x1, y1]], '', np.array(pen_color)]
-            elif line[0] == 'drawCurve':
-                item_id = line[1]
-                point_list = []
-                for i in range(2, len(line) - 1, 2):
-                    point_list.append([int(line[i]), int(line[i+1])])
-                algorithm = line[-1]
-                item_dict[item_id] = ['curve', point_list, algorithm, np.array(pen_color)]
-            elif line[0] == 'translate':
-                item_id = line[1]
-                dx = int(line[2])
-                dy = int(line[3])
-                _, p_list, _, _ = item_dict[item_id]
-                result_list = alg.translate(p_list, dx, dy)
-                item_dict[item_id][1] = result_list
-            elif line[0] == 'rotate':
-                item_id = line[1]
-                x = int(line[2])
-                y = int(line[3])
-                r = float(line[4])
-                _, p_list, _, _ = item_dict[item_id]
-                result_list = alg.rotate(p_list, x, y, r)
-                item_dict[item_id][1] = result_list
-            elif line[0] == 'scale':
-                item_id = line[1]
-                x = int(line[2])
-                y = int(line[3])
-                s = float(line[4])
-                _, p_list, _, _ = item_dict[item_id]
-                # TODO: just need to expand the control points? or whole points
-                result_list = alg.scale(p_list, x, y, s)
-                item_dict[item_id][1] = result_list
-            elif line[0] == 'clip':
-                item_id = line[1]
-                x_min = int(line[2])
-                y_min = int(line[3])
-                x_max = int(line[4])
-                y_max = int(line[5])
-                algorithm = line[-1]
-                _, p_list, _, _ = item_dict[item_id]
-                result_list = alg.clip(p_list, x_min, y_min, x_max, y_max, algorithm)
-                if result_list == None:
-                    del item_dict[item_id]
-                else:
-                    item_dict[item_id][1] = result_list
-
-            ...
-
-            line = fp.readline()
+    :param inputs: (list of string) 指令文件列表
+    :param output_dir: (string) 图像保存的根目录
+    :return: (list of string) 与inputs一一对应的输出目录
+    """
+    used = set()
+    result = []
+    for input_file in inputs:
+        stem = os.path.splitext(os.path.basename(input_file))[0]
+        name = stem
+        n = 0
+        while name in used:
+            n += 1
+            name = '%s_%d' % (stem, n)
+        used.add(name)
+        result.append(os.path.join(output_dir, name))
+    return result
 
+
+def _render_file(input_file, output_dir):
+    start = time.perf_counter()
+    run(input_file, output_dir)
+    return time.perf_counter() - start
+
+
+def run_batch(inputs, output_dir, workers=None, log=sys.stderr):
+    """用进程池并行执行多个指令文件，单个文件出错不影响其他文件
+
+    :param inputs: (list of string) 指令文件列表
+    :param output_dir: (string) 图像保存的根目录，每个文件的图像保存在各自的子目录中
+    :param workers: (int) 进程数，None表示使用CPU核数
+    :param log: (file object) 输出进度和每个文件用时的位置，None表示不输出
+    :return: (dict) 每个指令文件的输出目录到用时（秒）或异常的映射，同一文件出现多次时各自对应不同的输出目录
+    """
+    results = {}
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for input_file, file_output_dir in zip(inputs, batch_output_dirs(inputs, output_dir)):
+            futures[executor.submit(_render_file, input_file, file_output_dir)] = (input_file, file_output_dir)
+        for done, future in enumerate(as_completed(futures), 1):
+            input_file, file_output_dir = futures[future]
+            try:
+                results[file_output_dir] = future.result()
+                message = '%.3fs' % results[file_output_dir]
+            except Exception as e:
+                results[file_output_dir] = e
+                message = 'failed: %r' % e
+            if log is not None:
+                print('[%d/%d] %s -> %s %s' % (done, len(futures), input_file, file_output_dir, message),
+                      file=log, flush=True)
+    if log is not None:
+        failed = sum(isinstance(r, Exception) for r in results.values())
+        print('%d files, %d failed, %.3fs' % (len(futures), failed, time.perf_counter() - start), file=log)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='执行图元绘制指令文件并保存画布')
+    parser.add_argument('inputs', nargs='+', help='指令文件；给出多个文件或目录时进入批处理模式')
+    parser.add_argument('output_dir', help='图像保存目录')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='批处理模式的进程数，默认为CPU核数；指定后单个文件也按批处理模式执行')
+    parser.add_argument('-t', '--tile-workers', type=int, default=None,
+                        help='单个文件时把画布分块，用该数目的进程并行渲染每次saveCanvas')
+    parser.add_argument('--tile-size', type=int, default=TILE_SIZE, help='分块渲染时块的边长')
+    parser.add_argument('--resume', default=None, metavar='SNAPSHOT',
+                        help='单个文件时从saveScene保存的场景快照恢复，只执行快照之后的指令')
+    parser.add_argument('--cache-stats', action='store_true', help='单个文件时在标准错误输出形状缓存的命中统计和场景占用的内存')
+    args = parser.parse_args(argv)
+    if len(args.inputs) == 1 and not os.path.isdir(args.inputs[0]) and args.workers is None:
+        interpreter = run(args.inputs[0], args.output_dir, args.tile_workers, args.tile_size, args.resume)
+        if args.cache_stats:
+            cache = interpreter.shape_cache
+            print('shape cache: %d hits, %d misses, %d evictions, %d entries, %d bytes' %
+                  (cache.hits, cache.misses, cache.evictions, len(cache.entries), cache.nbytes), file=sys.stderr)
+            scene = interpreter.scene
+            print('scene: %d items, %d bytes, %.1f bytes/item' %
+                  (len(scene), scene.nbytes(), scene.nbytes() / max(len(scene), 1)), file=sys.stderr)
+        return 0
+    results = run_batch(collect_inputs(args.inputs), args.output_dir, args.workers)
+    return 1 if any(isinstance(r, Exception) for r in results.values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,6 +3,8 @@
 
 import sys
 import cg_algorithms as alg
+import cg_array
+from cg_scene import SceneStore, SNAPSHOT_SUFFIX, save_snapshot, load_snapshot
 from typing import Optional
 from PyQt5.QtWidgets import (
     QApplication,
@@ -14,14 +16,84 @@ from PyQt5.QtWidgets import (
     QListWidget,
     QHBoxLayout,
     QWidget,
+    QLabel,
     QStyleOptionGraphicsItem, )
-from PyQt5.QtGui import QPainter, QMouseEvent, QColor, QMoveEvent
-from PyQt5.QtCore import QRectF, Qt
+from PyQt5.QtGui import QPainter, QMouseEvent, QColor, QMoveEvent, QImage, QPolygon
+from PyQt5.QtCore import QRectF, Qt, QPoint
 from PyQt5.Qt import QPalette, QColorDialog, QPen, QInputDialog, QFileDialog
 import math
+import time
+from collections import deque
 import numpy as np
 from PIL import Image
 
+# 空间索引网格的边长，以及选择图元时点击位置与笔画的最大距离（像素）
+SPATIAL_CELL_SIZE = 64
+PICK_TOLERANCE = 4
+# 统计平均重绘用时的帧数
+FRAME_TIME_WINDOW = 30
+# 像素点数不低于包围盒面积的这一比例时（如填充多边形）画到离屏图像上，否则缓存为点列逐点绘制，内存与像素点数成正比
+IMAGE_MIN_DENSITY = 0.25
+
+
+class SpatialIndex:
+    """
+    均匀网格空间索引，记录每个图元的包围盒，按点查询附近的图元
+    """
+
+    def __init__(self, cell_size=SPATIAL_CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = {}  # 网格坐标到图元ID集合
+        self.rects = {}  # 图元ID到包围盒 (x_min, y_min, x_max, y_max)
+        self.order = {}  # 图元ID到加入顺序，越大越靠上
+        self.count = 0
+
+    def _cell_range(self, x_min, y_min, x_max, y_max):
+        size = self.cell_size
+        for cx in range(int(x_min // size), int(x_max // size) + 1):
+            for cy in range(int(y_min // size), int(y_max // size) + 1):
+                yield cx, cy
+
+    def insert(self, item_id, rect):
+        """加入图元，已存在时更新其包围盒"""
+        if item_id in self.rects:
+            self._unlink(item_id)
+        else:
+            self.count += 1
+            self.order[item_id] = self.count
+        self.rects[item_id] = rect
+        for cell in self._cell_range(*rect):
+            self.cells.setdefault(cell, set()).add(item_id)
+
+    def remove(self, item_id):
+        if item_id in self.rects:
+            self._unlink(item_id)
+            del self.rects[item_id]
+            del self.order[item_id]
+
+    def _unlink(self, item_id):
+        for cell in self._cell_range(*self.rects[item_id]):
+            ids = self.cells[cell]
+            ids.discard(item_id)
+            if not ids:
+                del self.cells[cell]
+
+    def clear(self):
+        self.cells = {}
+        self.rects = {}
+        self.order = {}
+        self.count = 0
+
+    def query(self, x, y, radius=0):
+        """返回包围盒外扩radius后包含点(x, y)的图元ID"""
+        result = set()
+        for cell in self._cell_range(x - radius, y - radius, x + radius, y + radius):
+            for item_id in self.cells.get(cell, ()):
+                x_min, y_min, x_max, y_max = self.rects[item_id]
+                if x_min - radius <= x <= x_max + radius and y_min - radius <= y <= y_max + radius:
+                    result.add(item_id)
+        return result
+
 
 class MyCanvas(QGraphicsView):
     """
@@ -33,6 +105,7 @@ class MyCanvas(QGraphicsView):
         self.main_window = None
         self.list_widget = None
         self.item_dict = {}
+        self.spatial_index = SpatialIndex()
         self.selected_id = ''
 
         self.status = ''
@@ -51,8 +124,11 @@ class MyCanvas(QGraphicsView):
 
         self.pen_color = QColor(0, 0, 0)
 
+        self.frame_times = deque(maxlen=FRAME_TIME_WINDOW)
+
     def reset_canvas(self, item_id):
         self.item_dict = {}
+        self.spatial_index.clear()
         self.status = ''
         self.draw_status = 'end'
         self.temp_id = item_id
@@ -94,6 +170,7 @@ class MyCanvas(QGraphicsView):
             self.list_widget.takeItem(index)
             self.scene().removeItem(self.item_dict[delete_id])
             self.item_dict.pop(delete_id)
+            self.spatial_index.remove(delete_id)
         return True, delete_id
 
     def select_action(self):
@@ -135,28 +212,82 @@ class MyCanvas(QGraphicsView):
             self.status = ''
         self.updateScene([self.sceneRect()])
 
+    def pick_item(self, x, y):
+        """选择笔画离(x, y)最近的图元，没有笔画在PICK_TOLERANCE以内时选择包围盒包含该点的最上层图元
+
+        :return: (string) 图元ID，没有图元时为None
+        """
+        candidates = self.spatial_index.query(x, y, PICK_TOLERANCE)
+        best_id, best_key = None, None
+        for item_id in candidates:
+            pixels = self.item_dict[item_id].get_pixels()
+            if len(pixels) == 0:
+                continue
+            distance = ((np.asarray(pixels) - [x, y]) ** 2).sum(axis=1).min()
+            key = (distance, -self.spatial_index.order[item_id])
+            if distance <= PICK_TOLERANCE ** 2 and (best_key is None or key < best_key):
+                best_id, best_key = item_id, key
+        if best_id is not None:
+            return best_id
+        inside = [item_id for item_id in candidates if self.item_dict[item_id].is_in_bounding_rect(x, y)]
+        if inside:
+            return max(inside, key=self.spatial_index.order.get)
+        return None
+
     def get_selected_item(self):
         for item in self.scene().items():
             if item.id == self.selected_id:
                 return item
         return None
 
+    def damage_rects(self):
+        """正在绘制或编辑的图元和裁剪框的当前包围盒"""
+        return [QRectF(item.boundingRect()) for item in (self.temp_item, self.clip_rect_item) if item is not None]
+
+    def update_damage(self, rects):
+        """只重绘rects与当前damage_rects的并集，不再刷新整个场景
+
+        :param rects: (list of QRectF) 修改前记录的damage_rects
+        """
+        region = QRectF()
+        for rect in rects + self.damage_rects():
+            region = region.united(rect)
+        if not region.isNull():
+            # 选中时的虚线框画在包围盒边上，外扩几个像素
+            self.updateScene([region.adjusted(-2, -2, 2, 2)])
+
+    def paintEvent(self, event) -> None:
+        start = time.perf_counter()
+        super().paintEvent(event)
+        self.frame_times.append(time.perf_counter() - start)
+        if self.main_window is not None:
+            self.main_window.frame_time_label.setText('%.2f ms' % (1000 * self.frame_time()))
+
+    def frame_time(self):
+        """最近FRAME_TIME_WINDOW次重绘的平均用时（秒）"""
+        if not self.frame_times:
+            return 0
+        return sum(self.frame_times) / len(self.frame_times)
+
     def mousePressEvent(self, event: QMouseEvent) -> None:
         if self.draw_status == 'start' and \
                 self.status != 'polygon' and self.status != 'curve':
+            damage = self.damage_rects()
             self.temp_item.status = 'finish'
             self.item_dict[self.temp_id] = self.temp_item
+            self.spatial_index.insert(self.temp_id, self.temp_item.bounds())
             self.list_widget.addItem(self.temp_id)
             self.finish_draw()
             self.temp_item = None
             self.draw_status = 'end'
-            self.updateScene([self.sceneRect()])
+            self.update_damage(damage)
         if event.button() == Qt.LeftButton:
             self.get_mouse_left_event(event)
         elif event.button() == Qt.RightButton:
             self.get_mouse_right_event(event)
 
     def get_mouse_left_event(self, event: QMouseEvent):
+        damage = self.damage_rects()
         pos = self.mapToScene(event.localPos().toPoint())
         x = int(pos.x())
         y = int(pos.y())
@@ -172,6 +303,7 @@ class MyCanvas(QGraphicsView):
                 self.draw_status = 'start'
             else:
                 self.temp_item.p_list.append([x, y])
+                self.temp_item.invalidate()
         elif self.status == 'ellipse':
             self.temp_item = MyItem(self.temp_id, self.status, [[x, y], [x, y]], self.temp_algorithm,
                                     pen_color=self.pen_color)
@@ -184,11 +316,11 @@ class MyCanvas(QGraphicsView):
                 self.draw_status = 'start'
             else:
                 self.temp_item.p_list.append([x, y])
+                self.temp_item.invalidate()
         elif self.status == 'select':
-            for item in self.scene().items():
-                if item.is_in_bounding_rect(x, y):
-                    self.selection_changed(item.id)
-                    break
+            item_id = self.pick_item(x, y)
+            if item_id is not None:
+                self.selection_changed(item_id)
         elif self.status == 'translate':
             self.temp_item = self.get_selected_item()
             if self.temp_item is None:
@@ -219,26 +351,28 @@ class MyCanvas(QGraphicsView):
                 self.begin_p_list.append(point.copy())
         elif self.status == 'clip':
             self.temp_item = self.get_selected_item()
-            if self.temp_item is None or self.temp_item.item_type != 'line':
+            if self.temp_item is None or self.temp_item.item_type not in ('line', 'polygon'):
                 self.temp_item = None
                 return
             self.clip_rect_item = MyItem('clip', self.status, [[x, y], [x, y]], None, None)
             self.scene().addItem(self.clip_rect_item)
             self.begin_position = [x, y]
-        self.updateScene([self.sceneRect()])
+        self.update_damage(damage)
         super().mousePressEvent(event)
 
     def get_mouse_right_event(self, event: QMouseEvent):
         if self.temp_item is None:
             return
+        damage = self.damage_rects()
         if self.status == 'polygon' or self.status == 'curve':
             self.temp_item.status = 'finish'
             self.item_dict[self.temp_id] = self.temp_item
+            self.spatial_index.insert(self.temp_id, self.temp_item.bounds())
             self.list_widget.addItem(self.temp_id)
             self.finish_draw()
             self.temp_item = None
             self.draw_status = 'end'
-        self.updateScene([self.sceneRect()])
+        self.update_damage(damage)
         super().mouseDoubleClickEvent(event)
 
     def mouseMoveEvent(self, event: QMouseEvent) -> None:
@@ -247,13 +381,17 @@ class MyCanvas(QGraphicsView):
         y = int(pos.y())
         if self.temp_item is None:
             return
+        damage = self.damage_rects()
         if self.status == 'line':
             self.temp_item.p_list[1] = [x, y]
+            self.temp_item.invalidate()
         elif self.status == 'polygon':
             point_count = len(self.temp_item.p_list)
             self.temp_item.p_list[point_count - 1] = [x, y]
+            self.temp_item.invalidate()
         elif self.status == 'ellipse':
             self.temp_item.p_list[1] = [x, y]
+            self.temp_item.invalidate()
         elif self.status == 'curve':
             pass
         elif self.status == 'translate':
@@ -274,15 +412,18 @@ class MyCanvas(QGraphicsView):
             self.temp_item.p_list = alg.scale(self.begin_p_list, self.center_point[0], self.center_point[1], s)
         elif self.status == 'clip':
             self.clip_rect_item.p_list[1] = [x, y]
+            self.clip_rect_item.invalidate()
             self.end_position = [x, y]
-        self.updateScene([self.sceneRect()])
+        self.update_damage(damage)
         super().mouseMoveEvent(event)
 
     def mouseReleaseEvent(self, event: QMouseEvent) -> None:
         if self.temp_item is None:
             return
+        damage = self.damage_rects()
         if self.status == 'line':
             self.item_dict[self.temp_id] = self.temp_item
+            self.spatial_index.insert(self.temp_id, self.temp_item.bounds())
             self.list_widget.addItem(self.temp_id)
             self.finish_draw()
             self.temp_item = None
@@ -290,27 +431,33 @@ class MyCanvas(QGraphicsView):
             pass
         elif self.status == 'ellipse':
             self.item_dict[self.temp_id] = self.temp_item
+            self.spatial_index.insert(self.temp_id, self.temp_item.bounds())
             self.list_widget.addItem(self.temp_id)
             self.finish_draw()
             self.temp_item = None
         elif self.status == 'curve':
             pass
         elif self.status == 'translate':
-            pass
+            self.spatial_index.insert(self.temp_item.id, self.temp_item.bounds())
         elif self.status == 'rotate':
             self.begin_p_list = []
             for point in self.temp_item.p_list:
                 self.begin_p_list.append(point.copy())
+            self.spatial_index.insert(self.temp_item.id, self.temp_item.bounds())
         elif self.status == 'scale':
             self.begin_p_list = []
             for point in self.temp_item.p_list:
                 self.begin_p_list.append(point.copy())
+            self.spatial_index.insert(self.temp_item.id, self.temp_item.bounds())
         elif self.status == 'clip':
             xmin = min(self.begin_position[0], self.end_position[0])
             xmax = max(self.begin_position[0], self.end_position[0])
             ymin = min(self.begin_position[1], self.end_position[1])
             ymax = max(self.begin_position[1], self.end_position[1])
-            self.temp_item.p_list = alg.clip(self.temp_item.p_list, xmin, ymin, xmax, ymax, self.temp_algorithm)
+            if self.temp_item.item_type == 'polygon':
+                self.temp_item.p_list = alg.clip_polygon(self.temp_item.p_list, xmin, ymin, xmax, ymax)
+            else:
+                self.temp_item.p_list = alg.clip(self.temp_item.p_list, xmin, ymin, xmax, ymax, self.temp_algorithm)
             if len(self.temp_item.p_list) == 0:
                 count = self.list_widget.count()
                 index = 0
@@ -319,10 +466,14 @@ class MyCanvas(QGraphicsView):
                         index = i
                 self.list_widget.takeItem(index)
                 self.scene().removeItem(self.temp_item)
+                self.item_dict.pop(self.temp_item.id)
+                self.spatial_index.remove(self.temp_item.id)
                 self.selected_id = ''
+            else:
+                self.spatial_index.insert(self.temp_item.id, self.temp_item.bounds())
             self.scene().removeItem(self.clip_rect_item)
             self.clip_rect_item = None
-            self.updateScene([self.sceneRect()])
+            self.update_damage(damage)
         super().mouseReleaseEvent(event)
 
     def save_current_canvas(self, filepath, width, height):
@@ -332,6 +483,35 @@ class MyCanvas(QGraphicsView):
             item.get_canvas(canvas)
         Image.fromarray(canvas).save(filepath)
 
+    def save_project(self, filepath, width, height):
+        """把画布上的图元保存为与cg_cli的saveScene相同格式的场景快照"""
+        scene = SceneStore()
+        for item_id, item in self.item_dict.items():
+            color = item.pen_color
+            scene.add(item_id, item.item_type, item.p_list, item.algorithm, (color.red(), color.green(), color.blue()))
+        pen_color = (self.pen_color.red(), self.pen_color.green(), self.pen_color.blue())
+        save_snapshot(filepath, scene, width, height, pen_color)
+
+    def load_project(self, scene, pending_transforms=None):
+        """把场景快照中的图元加到刚重置的画布上
+
+        :param scene: (SceneStore) 快照中的场景
+        :param pending_transforms: (dict) 快照中尚未作用到控制点上的变换矩阵，加入画布前作用并取整
+        """
+        pending_transforms = pending_transforms or {}
+        item_ids = list(pending_transforms)
+        p_lists = [scene.get_points(item_id) for item_id in item_ids]
+        matrices = [pending_transforms[item_id] for item_id in item_ids]
+        transformed = dict(zip(item_ids, map(cg_array.round_points, cg_array.transform_items(p_lists, matrices))))
+        for item_id in scene:
+            item_type, p_list, algorithm, color = scene[item_id]
+            p_list = transformed.get(item_id, p_list)
+            item = MyItem(item_id, item_type, p_list, algorithm, pen_color=QColor(*color.tolist()))
+            self.scene().addItem(item)
+            self.item_dict[item_id] = item
+            self.spatial_index.insert(item_id, item.bounds())
+            self.list_widget.addItem(item_id)
+
 
 class MyItem(QGraphicsItem):
     """
@@ -349,6 +529,10 @@ class MyItem(QGraphicsItem):
         :param parent:
         """
         super().__init__(parent)
+        self._pixels = None  # 缓存的像素点，p_list、algorithm、item_type改变时失效
+        self._bounding_rect = None
+        self._drawing = None  # 缓存的离屏图像或点列，几何或颜色改变时失效
+        self._image_buffer = None
         self.id = item_id  # 图元ID
         self.item_type = item_type  # 图元类型，'line'、'polygon'、'ellipse'、'curve'等
         self.p_list = p_list  # 图元参数
@@ -358,30 +542,111 @@ class MyItem(QGraphicsItem):
 
         self.status = status
 
+    @property
+    def p_list(self):
+        return self._p_list
+
+    @p_list.setter
+    def p_list(self, p_list):
+        self._p_list = p_list
+        self.invalidate()
+
+    @property
+    def algorithm(self):
+        return self._algorithm
+
+    @algorithm.setter
+    def algorithm(self, algorithm):
+        self._algorithm = algorithm
+        self.invalidate()
+
+    @property
+    def item_type(self):
+        return self._item_type
+
+    @item_type.setter
+    def item_type(self, item_type):
+        self._item_type = item_type
+        self.invalidate()
+
+    @property
+    def pen_color(self):
+        return self._pen_color
+
+    @pen_color.setter
+    def pen_color(self, pen_color):
+        self._pen_color = pen_color
+        self._drawing = None
+        self._image_buffer = None
+
+    def invalidate(self):
+        """丢弃缓存的像素点、包围盒和图像，原地修改p_list（如append、p_list[i] = ...）后需要调用"""
+        self._drawing = None
+        self._image_buffer = None
+        if self._pixels is None and self._bounding_rect is None:
+            return
+        self.prepareGeometryChange()
+        self._pixels = None
+        self._bounding_rect = None
+
+    def _get_drawing(self):
+        """缓存绘制用的数据：稠密的像素点画到离屏QImage上，返回(左上角坐标, QImage)；稀疏的笔画返回像素点组成的QPolygon"""
+        if self._drawing is None:
+            pixels = np.asarray(self.get_pixels(), np.int32).reshape(-1, 2)
+            if len(pixels) == 0:
+                self._drawing = QPolygon()
+                return self._drawing
+            x_min, y_min = pixels.min(axis=0).tolist()
+            x_max, y_max = pixels.max(axis=0).tolist()
+            w, h = x_max - x_min + 1, y_max - y_min + 1
+            if len(pixels) >= IMAGE_MIN_DENSITY * w * h:
+                self._image_buffer = np.zeros((h, w), np.uint32)
+                self._image_buffer[pixels[:, 1] - y_min, pixels[:, 0] - x_min] = self.pen_color.rgba()
+                image = QImage(self._image_buffer.data, w, h, 4 * w, QImage.Format_ARGB32)
+                self._drawing = (QPoint(x_min, y_min), image)
+            else:
+                # 直接把坐标写入QPolygon的int32缓冲区
+                polygon = QPolygon(len(pixels))
+                buffer = polygon.data()
+                buffer.setsize(pixels.nbytes)
+                np.frombuffer(buffer, np.int32)[:] = pixels.ravel()
+                self._drawing = polygon
+        return self._drawing
+
+    def _paint_pixels(self, painter: QPainter):
+        drawing = self._get_drawing()
+        if isinstance(drawing, QPolygon):
+            if not drawing.isEmpty():
+                painter.drawPoints(drawing)
+        else:
+            painter.drawImage(*drawing)
+
+    @staticmethod
+    def _paint_control_points(painter: QPainter, p_list):
+        points = []
+        for point in p_list:
+            for p in alg.draw_curve_point(point):
+                points.append(QPoint(*p))
+        painter.drawPoints(QPolygon(points))
+
     def paint(self, painter: QPainter, option: QStyleOptionGraphicsItem, widget: Optional[QWidget] = ...) -> None:
         painter.setPen(self.pen_color)
         if self.item_type == 'line':
-            item_pixels = alg.draw_line(self.p_list, self.algorithm)
-            for p in item_pixels:
-                painter.drawPoint(*p)
+            self._paint_pixels(painter)
             if self.selected:
                 pen = QPen(Qt.DashLine)
                 pen.setColor(QColor(255, 0, 0))
                 painter.setPen(pen)
                 painter.drawRect(self.boundingRect())
         elif self.item_type == 'polygon':
-            item_pixels = alg.draw_polygon(self.p_list, self.algorithm)
-            for p in item_pixels:
-                painter.drawPoint(*p)
+            self._paint_pixels(painter)
             if self.selected:
                 pen = QPen(Qt.DashLine)
                 pen.setColor(QColor(255, 0, 0))
                 painter.setPen(pen)
                 painter.drawRect(self.boundingRect())
         elif self.item_type == 'ellipse':
-            item_pixels = alg.draw_ellipse(self.p_list)
-            for p in item_pixels:
-                painter.drawPoint(*p)
+            self._paint_pixels(painter)
             if self.selected:
                 pen = QPen(Qt.DashLine)
                 pen.setColor(QColor(255, 0, 0))
@@ -389,20 +654,12 @@ class MyItem(QGraphicsItem):
                 painter.drawRect(self.boundingRect())
         elif self.item_type == 'curve':
             if self.status != 'finish':
-                for point in self.p_list:
-                    pixels = alg.draw_curve_point(point)
-                    for p in pixels:
-                        painter.drawPoint(*p)
-            item_pixels = alg.draw_curve(self.p_list, self.algorithm)
-            for p in item_pixels:
-                painter.drawPoint(*p)
+                self._paint_control_points(painter, self.p_list)
+            self._paint_pixels(painter)
             if self.selected:
                 pen = QPen(Qt.DashLine)
                 pen.setColor(QColor(255, 0, 0))
-                for point in self.p_list:
-                    pixels = alg.draw_curve_point(point)
-                    for p in pixels:
-                        painter.drawPoint(*p)
+                self._paint_control_points(painter, self.p_list)
                 painter.setPen(pen)
                 painter.drawRect(self.boundingRect())
         elif self.item_type == 'clip':
@@ -412,6 +669,11 @@ class MyItem(QGraphicsItem):
             painter.drawRect(self.boundingRect())
 
     def boundingRect(self) -> QRectF:
+        if self._bounding_rect is None:
+            self._bounding_rect = self._calculate_bounding_rect()
+        return self._bounding_rect
+
+    def _calculate_bounding_rect(self) -> QRectF:
         if len(self.p_list) == 0:
             return QRectF(0, 0, 0, 0)
         if self.item_type == 'line' or self.item_type == 'clip':
@@ -440,8 +702,37 @@ class MyItem(QGraphicsItem):
             y = min(y0, y1)
             w = max(x0, x1) - x
             h = max(y0, y1) - y
+            # 细长椭圆的像素点可能超出控制点的矩形，包围盒取两者的并
+            bound = alg.ellipse_bound(self.p_list)
+            if bound is not None:
+                x_min, y_min = min(x, bound[0]), min(y, bound[1])
+                w, h = max(x + w, bound[2]) - x_min, max(y + h, bound[3]) - y_min
+                x, y = x_min, y_min
             return QRectF(x - 1, y - 1, w + 2, h + 2)
 
+    def bounds(self):
+        """包围盒 (x_min, y_min, x_max, y_max)"""
+        x, y, w, h = self.boundingRect().getRect()
+        return x, y, x + w, y + h
+
+    def get_pixels(self):
+        """图元笔画的像素点（不含曲线控制点），计算一次后缓存"""
+        if self._pixels is None:
+            if self.item_type == 'line':
+                self._pixels = alg.draw_line(self.p_list, self.algorithm)
+            elif self.item_type == 'polygon' and self.algorithm == 'Fill':
+                self._pixels = [(x, y) for y, x_start, x_end in alg.fill_polygon(self.p_list)
+                                for x in range(x_start, x_end + 1)]
+            elif self.item_type == 'polygon':
+                self._pixels = alg.draw_polygon(self.p_list, self.algorithm)
+            elif self.item_type == 'ellipse':
+                self._pixels = alg.draw_ellipse(self.p_list)
+            elif self.item_type == 'curve':
+                self._pixels = alg.draw_curve(self.p_list, self.algorithm)
+            else:
+                self._pixels = []
+        return self._pixels
+
     def is_in_bounding_rect(self, x_pos, y_pos):
         rect = self.boundingRect()
         x, y, w, h = rect.x(), rect.y(), rect.width(), rect.height()
@@ -454,22 +745,19 @@ class MyItem(QGraphicsItem):
         pen_color[0] = self.pen_color.red()
         pen_color[1] = self.pen_color.green()
         pen_color[2] = self.pen_color.blue()
-        if self.item_type == 'line':
-            item_pixels = alg.draw_line(self.p_list, self.algorithm)
-            for x, y in item_pixels:
-                canvas[y, x] = pen_color
-        elif self.item_type == 'polygon':
-            item_pixels = alg.draw_polygon(self.p_list, self.algorithm)
-            for x, y in item_pixels:
-                canvas[y, x] = pen_color
-        elif self.item_type == 'ellipse':
-            item_pixels = alg.draw_ellipse(self.p_list)
-            for x, y in item_pixels:
-                canvas[y, x] = pen_color
-        elif self.item_type == 'curve':
-            item_pixels = alg.draw_curve(self.p_list, self.algorithm)
-            for x, y in item_pixels:
-                canvas[y, x] = pen_color
+        # 跳过画布以外的像素点，完全在画布外的图元不做光栅化
+        height, width = canvas.shape[:2]
+        x_min, y_min, x_max, y_max = self.bounds()
+        if x_min >= width or y_min >= height or x_max < 0 or y_max < 0:
+            return
+        if self.item_type == 'polygon' and self.algorithm == 'Fill':
+            for y, x_start, x_end in alg.fill_polygon(self.p_list):
+                if 0 <= y < height:
+                    canvas[y, max(x_start, 0):max(x_end + 1, 0)] = pen_color
+            return
+        pixels = np.asarray(self.get_pixels(), np.int64).reshape(-1, 2)
+        inside = (pixels[:, 0] >= 0) & (pixels[:, 0] < width) & (pixels[:, 1] >= 0) & (pixels[:, 1] < height)
+        canvas[pixels[inside, 1], pixels[inside, 0]] = pen_color
 
 
 class MainWindow(QMainWindow):
@@ -499,6 +787,8 @@ class MainWindow(QMainWindow):
         set_pen_act = file_menu.addAction('设置画笔')
         reset_canvas_act = file_menu.addAction('重置画布')
         save_image_act = file_menu.addAction('保存图片')
+        save_project_act = file_menu.addAction('保存项目')
+        open_project_act = file_menu.addAction('打开项目')
         exit_act = file_menu.addAction('退出')
         draw_menu = menubar.addMenu('绘制')
         line_menu = draw_menu.addMenu('线段')
@@ -508,6 +798,7 @@ class MainWindow(QMainWindow):
         polygon_menu = draw_menu.addMenu('多边形')
         polygon_dda_act = polygon_menu.addAction('DDA')
         polygon_bresenham_act = polygon_menu.addAction('Bresenham')
+        polygon_fill_act = polygon_menu.addAction('填充')
         ellipse_act = draw_menu.addAction('椭圆')
         curve_menu = draw_menu.addMenu('曲线')
         curve_bezier_act = curve_menu.addAction('Bezier')
@@ -526,6 +817,8 @@ class MainWindow(QMainWindow):
         set_pen_act.triggered.connect(self.set_pen_action)
         reset_canvas_act.triggered.connect(self.reset_canvas_action)
         save_image_act.triggered.connect(self.save_image_action)
+        save_project_act.triggered.connect(self.save_project_action)
+        open_project_act.triggered.connect(self.open_project_action)
         exit_act.triggered.connect(qApp.quit)
 
         line_naive_act.triggered.connect(self.line_naive_action)
@@ -533,6 +826,7 @@ class MainWindow(QMainWindow):
         line_bresenham_act.triggered.connect(self.line_bresenham_action)
         polygon_dda_act.triggered.connect(self.polygon_dda_action)
         polygon_bresenham_act.triggered.connect(self.polygon_bresenham_action)
+        polygon_fill_act.triggered.connect(self.polygon_fill_action)
         ellipse_act.triggered.connect(self.ellipse_action)
         curve_bezier_act.triggered.connect(self.curve_bezier_action)
         curve_b_spline_act.triggered.connect(self.curve_b_spline_action)
@@ -555,6 +849,8 @@ class MainWindow(QMainWindow):
         self.central_widget.setLayout(self.hbox_layout)
         self.setCentralWidget(self.central_widget)
         self.statusBar().showMessage('空闲')
+        self.frame_time_label = QLabel('')
+        self.statusBar().addPermanentWidget(self.frame_time_label)
         self.resize(600, 600)
         self.setWindowTitle('CG SJQ')
 
@@ -579,7 +875,9 @@ class MainWindow(QMainWindow):
         width = width if ok_pressed else 600
         height, ok_pressed = QInputDialog.getInt(self, "Get Height", "Height:", 600, 600, 1000)
         height = height if ok_pressed else 600
+        self.reset_canvas(width, height)
 
+    def reset_canvas(self, width, height):
         self.list_widget.clearSelection()
         self.canvas_widget.clear_selection()
         self.item_cnt = 0
@@ -596,6 +894,31 @@ class MainWindow(QMainWindow):
         if file_path != '':
             self.canvas_widget.save_current_canvas(file_path, self.canvas_widget.width(), self.canvas_widget.height())
 
+    def save_project_action(self):
+        file_path, _ = QFileDialog.getSaveFileName(self, 'save project', './output',
+                                                   'Scene files(*%s)' % SNAPSHOT_SUFFIX)
+        if file_path != '':
+            self.canvas_widget.save_project(file_path, self.canvas_widget.width(), self.canvas_widget.height())
+            self.statusBar().showMessage('save project ' + file_path)
+
+    def open_project_action(self):
+        file_path, _ = QFileDialog.getOpenFileName(self, 'open project', './output',
+                                                   'Scene files(*%s)' % SNAPSHOT_SUFFIX)
+        if file_path == '':
+            return
+        try:
+            snapshot = load_snapshot(file_path, mmap=False)
+        except (OSError, ValueError) as e:
+            self.statusBar().showMessage('fail to open project: %s' % e)
+            return
+        self.reset_canvas(snapshot.width, snapshot.height)
+        self.canvas_widget.set_pen_color(QColor(*snapshot.pen_color.tolist()))
+        self.canvas_widget.load_project(snapshot.scene, snapshot.pending_transforms)
+        # 新图元的ID接在已有的数字ID之后
+        self.item_cnt = max([int(item_id) + 1 for item_id in snapshot.scene if item_id.isdigit()], default=0)
+        self.canvas_widget.temp_id = self.get_id()
+        self.statusBar().showMessage('open project ' + file_path)
+
     def line_naive_action(self):
         self.canvas_widget.start_draw_line('Naive', self.get_id())
         self.statusBar().showMessage('Naive draw line')
@@ -626,6 +949,12 @@ class MainWindow(QMainWindow):
         self.list_widget.clearSelection()
         self.canvas_widget.clear_selection()
 
+    def polygon_fill_action(self):
+        self.canvas_widget.start_draw_polygon('Fill', self.get_id())
+        self.statusBar().showMessage('Scanline fill polygon')
+        self.list_widget.clearSelection()
+        self.canvas_widget.clear_selection()
+
     def ellipse_action(self):
         self.canvas_widget.start_draw_ellipse(self.get_id())
         self.statusBar().showMessage('draw ellipse')
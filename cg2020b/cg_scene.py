@@ -0,0 +1,363 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+# 场景存储：所有图元按结构数组（structure of arrays）保存在几个numpy数组中
+import os
+import struct
+from collections import namedtuple
+import numpy as np
+
+# 图元类型编码
+ITEM_TYPES = ('line', 'polygon', 'ellipse', 'curve')
+# 预置的算法编码，其他算法名在第一次出现时依次追加
+ALGORITHMS = ('', 'DDA', 'Bresenham', 'Naive', 'Bezier', 'B-spline', 'Fill')
+# 各数组的初始容量，不够时容量翻倍
+INITIAL_CAPACITY = 16
+
+# 场景快照文件的标识、版本和扩展名
+SNAPSHOT_MAGIC = b'CGSCENE\x00'
+SNAPSHOT_VERSION = 3
+SNAPSHOT_SUFFIX = '.scene'
+
+# 快照文件头：标识、版本、画布宽高、快照所在的指令行号、画笔RGB，以及图元数、控制点数、ID表和算法名表的字节数、
+# 待处理变换数、指令文件中快照之后第一条指令的位置
+_HEADER = struct.Struct('<8sIIII3Bx4QIQ')
+# 文件头之后依次为ID表、算法名表、场景的各个数组和待处理变换，每段按8字节对齐
+_ALIGN = 8
+
+Snapshot = namedtuple('Snapshot', ['scene', 'width', 'height', 'pen_color', 'lineno', 'offset',
+                                   'pending_transforms'])
+
+_INT32_MIN = int(np.iinfo(np.int32).min)
+_INT32_MAX = int(np.iinfo(np.int32).max)
+
+
+def _check_points(p_list):
+    values = [v for point in p_list for v in point]
+    if values and (min(values) < _INT32_MIN or max(values) > _INT32_MAX):
+        raise OverflowError('control point out of int32 range')
+    return len(values) // 2
+
+
+def _grow(array, size):
+    if size <= len(array):
+        return array
+    result = np.zeros((max(size, 2 * len(array)),) + array.shape[1:], array.dtype)
+    result[:len(array)] = array
+    return result
+
+
+def packed_bounds(counts, points, margin=1):
+    """按控制点计算每个图元的包围盒
+
+    :param counts: (numpy.ndarray of int, shape (N,)) 每个图元的控制点数
+    :param points: (numpy.ndarray of int, shape (M, 2)) 按图元顺序紧凑排列的控制点
+    :param margin: (int) 包围盒外扩的像素数
+    :return: (numpy.ndarray of int, shape (N, 4)) (x_min, y_min, x_max, y_max)，没有控制点的图元为空盒
+    """
+    bounds = np.empty((len(counts), 4), np.int64)
+    bounds[:] = (1, 1, 0, 0)
+    nonempty = counts > 0
+    if nonempty.any():
+        offsets = np.cumsum(counts[nonempty]) - counts[nonempty]
+        bounds[nonempty, :2] = np.minimum.reduceat(points, offsets, axis=0) - margin
+        bounds[nonempty, 2:] = np.maximum.reduceat(points, offsets, axis=0) + margin
+    return bounds
+
+
+class SceneStore:
+    """
+    图元场景，按结构数组保存：每个图元一个类型编码、算法编码和RGB颜色，
+    以及在公共int32控制点缓冲区中的起始位置和点数；图元ID到槽位的映射仍用字典
+
+    用法与原来的item_dict相同：按绘制顺序迭代图元ID，scene[item_id]得到[item_type, p_list, algorithm, color]，
+    重绘已有ID的图元时保持其原来的顺序
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.slots = {}  # 图元ID -> 槽位
+        self.slot_ids = []  # 槽位 -> 图元ID，已删除的槽位为None
+        self.type_codes = np.zeros(INITIAL_CAPACITY, np.uint8)
+        self.algorithm_codes = np.zeros(INITIAL_CAPACITY, np.uint8)
+        self.colors = np.zeros((INITIAL_CAPACITY, 3), np.uint8)
+        self.starts = np.zeros(INITIAL_CAPACITY, np.int64)
+        self.counts = np.zeros(INITIAL_CAPACITY, np.int32)
+        self.points = np.zeros((INITIAL_CAPACITY, 2), np.int32)
+        self.points_used = 0  # 缓冲区中已分配的点数，包括被替换或删除的图元留下的空洞
+        self.points_live = 0
+        self.algorithms = list(ALGORITHMS)
+        self.algorithm_index = {name: i for i, name in enumerate(self.algorithms)}
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __contains__(self, item_id):
+        return item_id in self.slots
+
+    def __iter__(self):
+        return (item_id for item_id in self.slot_ids if item_id is not None)
+
+    def __getitem__(self, item_id):
+        slot = self.slots[item_id]
+        return [ITEM_TYPES[self.type_codes[slot]], self.get_points(item_id).tolist(),
+                self.algorithms[self.algorithm_codes[slot]], self.colors[slot].copy()]
+
+    def values(self):
+        return (self[item_id] for item_id in self)
+
+    def add(self, item_id, item_type, p_list, algorithm, color):
+        """添加图元，ID已存在时替换其内容
+
+        :param item_id: (string) 图元ID
+        :param item_type: (string) 图元类型，'line'、'polygon'、'ellipse'、'curve'
+        :param p_list: (list of list of int) 控制点坐标
+        :param algorithm: (string) 绘制算法
+        :param color: (array-like of int) RGB颜色
+        """
+        count = _check_points(p_list)
+        type_code = ITEM_TYPES.index(item_type)
+        algorithm_code = self._algorithm_code(algorithm)
+        slot = self.slots.get(item_id)
+        if slot is None:
+            slot = len(self.slot_ids)
+            self._reserve_slots(slot + 1)
+            self.slot_ids.append(item_id)
+            self.slots[item_id] = slot
+            self.counts[slot] = 0
+        self.type_codes[slot] = type_code
+        self.algorithm_codes[slot] = algorithm_code
+        self.colors[slot] = color
+        self._store_points(slot, p_list, count)
+
+    def get_points(self, item_id):
+        """图元的控制点
+
+        :return: (numpy.ndarray of int32, shape (N, 2)) 控制点缓冲区中的视图，修改控制点请用set_points
+        """
+        slot = self.slots[item_id]
+        start = self.starts[slot]
+        return self.points[start:start + self.counts[slot]]
+
+    def set_points(self, item_id, p_list):
+        """替换图元的控制点，点数不变时原地写入
+
+        :param p_list: (array-like of int, shape (N, 2)) 新的控制点坐标
+        """
+        self._store_points(self.slots[item_id], p_list, _check_points(p_list))
+
+    def remove(self, item_id):
+        slot = self.slots.pop(item_id)
+        self.slot_ids[slot] = None
+        self.points_live -= int(self.counts[slot])
+        self.counts[slot] = 0
+        self._maybe_compact()
+
+    def bounds(self, margin=1):
+        """按控制点计算每个图元的包围盒，所有图元一次计算
+
+        :param margin: (int) 包围盒外扩的像素数
+        :return: (numpy.ndarray of int, shape (N, 4)) 按迭代顺序的(x_min, y_min, x_max, y_max)，没有控制点的图元为空盒
+        """
+        slots = self._live_slots()
+        return packed_bounds(self.counts[slots], self.points[self._point_index(slots)], margin)
+
+    def packed_arrays(self):
+        """按迭代顺序紧凑排列的数组副本，不含已删除图元和控制点缓冲区中的空洞
+
+        :return: (dict) 'type_codes'、'algorithm_codes'、'colors'、'counts'和'points'到对应数组的映射
+        """
+        slots = self._live_slots()
+        return {'type_codes': self.type_codes[slots], 'algorithm_codes': self.algorithm_codes[slots],
+                'colors': self.colors[slots], 'counts': self.counts[slots],
+                'points': self.points[self._point_index(slots)]}
+
+    def positions(self, item_ids):
+        """
+        :param item_ids: (list of string) 图元ID
+        :return: (numpy.ndarray of int) 各图元在迭代顺序中的下标
+        """
+        return np.searchsorted(self._live_slots(), [self.slots[item_id] for item_id in item_ids])
+
+    def nbytes(self):
+        """结构数组占用的字节数（按已分配的容量计），不含图元ID字符串和ID字典"""
+        return sum(array.nbytes for array in (self.type_codes, self.algorithm_codes, self.colors,
+                                              self.starts, self.counts, self.points))
+
+    def compact(self):
+        """去掉已删除的槽位和控制点缓冲区中的空洞，保持图元顺序"""
+        slots = self._live_slots()
+        counts = self.counts[slots]
+        points = self.points[self._point_index(slots)]
+        self.type_codes = self.type_codes[slots]
+        self.algorithm_codes = self.algorithm_codes[slots]
+        self.colors = self.colors[slots]
+        self.counts = counts
+        self.starts = np.cumsum(counts, dtype=np.int64) - counts
+        self.points = points
+        self.points_used = self.points_live = len(points)
+        self.slot_ids = [self.slot_ids[slot] for slot in slots.tolist()]
+        self.slots = {item_id: slot for slot, item_id in enumerate(self.slot_ids)}
+
+    def _live_slots(self):
+        return np.array([slot for slot, item_id in enumerate(self.slot_ids) if item_id is not None], np.int64)
+
+    def _point_index(self, slots):
+        counts = self.counts[slots].astype(np.int64)
+        offsets = np.cumsum(counts) - counts
+        return np.repeat(self.starts[slots] - offsets, counts) + np.arange(counts.sum())
+
+    def _reserve_slots(self, size):
+        if size <= len(self.type_codes):
+            return
+        self.type_codes = _grow(self.type_codes, size)
+        self.algorithm_codes = _grow(self.algorithm_codes, size)
+        self.colors = _grow(self.colors, size)
+        self.starts = _grow(self.starts, size)
+        self.counts = _grow(self.counts, size)
+
+    def _algorithm_code(self, algorithm):
+        code = self.algorithm_index.get(algorithm)
+        if code is None:
+            code = len(self.algorithms)
+            if code > np.iinfo(np.uint8).max:
+                raise ValueError('too many algorithm names')
+            self.algorithms.append(algorithm)
+            self.algorithm_index[algorithm] = code
+        return code
+
+    def _store_points(self, slot, p_list, count):
+        old_count = int(self.counts[slot])
+        if count != old_count:
+            # 点数变化时在缓冲区末尾重新分配，原来的位置成为空洞
+            self.points = _grow(self.points, self.points_used + count)
+            self.starts[slot] = self.points_used
+            self.counts[slot] = count
+            self.points_used += count
+            self.points_live += count - old_count
+        if count:
+            start = self.starts[slot]
+            self.points[start:start + count] = p_list
+        self._maybe_compact()
+
+    def _maybe_compact(self):
+        if len(self.slot_ids) > 2 * len(self.slots) + INITIAL_CAPACITY or \
+                self.points_used > 2 * self.points_live + INITIAL_CAPACITY:
+            self.compact()
+
+
+def _padding(offset):
+    return -offset % _ALIGN
+
+
+def _array_sections(n_items, n_points, n_pending):
+    return [('type_codes', np.uint8, (n_items,)),
+            ('algorithm_codes', np.uint8, (n_items,)),
+            ('colors', np.uint8, (n_items, 3)),
+            ('starts', np.dtype('<i8'), (n_items,)),
+            ('counts', np.dtype('<i4'), (n_items,)),
+            ('points', np.dtype('<i4'), (n_points, 2)),
+            ('pending_items', np.dtype('<i8'), (n_pending,)),
+            ('pending_matrices', np.dtype('<f8'), (n_pending, 3, 3))]
+
+
+def save_snapshot(path, scene, width=0, height=0, pen_color=(0, 0, 0), lineno=0, offset=0,
+                  pending_transforms=None):
+    """把场景保存为二进制快照，先写临时文件再替换，写到一半中断不会留下损坏的快照
+
+    格式为文件头、以换行分隔的ID表和算法名表，之后是按图元顺序紧凑排列的类型编码、算法编码、颜色、
+    控制点起始位置、控制点数和int32控制点，最后是待处理变换的图元序号和3x3浮点矩阵，所有数值均为小端序
+
+    :param path: (string) 快照路径
+    :param scene: (SceneStore) 场景，保存前去掉已删除图元留下的空洞
+    :param width: (int) 画布宽度
+    :param height: (int) 画布高度
+    :param pen_color: (array-like of int) 画笔RGB颜色
+    :param lineno: (int) 快照对应的指令行号，从快照恢复时跳过该行及之前的指令
+    :param offset: (int) 指令文件中该行之后的位置（文件对象tell()的结果），从快照恢复时直接seek到这里
+    :param pending_transforms: (dict) 图元ID到尚未作用到控制点上的变换矩阵，原样保存，不在保存时取整
+    """
+    if len(scene.slot_ids) != len(scene) or scene.points_used != scene.points_live:
+        scene.compact()
+    ids = list(scene)
+    if any('\n' in item_id for item_id in ids):
+        raise ValueError('item id must not contain a newline')
+    id_table = '\n'.join(ids).encode('utf-8')
+    algorithm_table = '\n'.join(scene.algorithms).encode('utf-8')
+    n_items = len(ids)
+    n_points = scene.points_used
+    pending_transforms = pending_transforms or {}
+    arrays = {name: getattr(scene, name)[:n_items] for name in ('type_codes', 'algorithm_codes', 'colors',
+                                                                 'starts', 'counts')}
+    arrays['points'] = scene.points[:n_points]
+    arrays['pending_items'] = np.array([scene.slots[item_id] for item_id in pending_transforms], np.int64)
+    arrays['pending_matrices'] = np.array(list(pending_transforms.values()), np.float64).reshape(-1, 3, 3)
+    header = _HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, width, height, lineno, *(int(c) for c in pen_color),
+                          n_items, n_points, len(id_table), len(algorithm_table), len(pending_transforms), offset)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as fp:
+        fp.write(header)
+        for blob in (id_table, algorithm_table):
+            fp.write(blob)
+            fp.write(bytes(_padding(len(blob))))
+        for name, dtype, shape in _array_sections(n_items, n_points, len(pending_transforms)):
+            data = arrays[name].astype(dtype, copy=False)
+            fp.write(data.tobytes())
+            fp.write(bytes(_padding(data.nbytes)))
+    os.replace(temp_path, path)
+
+
+def load_snapshot(path, mmap=True):
+    """读取save_snapshot保存的快照
+
+    mmap为True时各数组以写时复制方式映射到文件，读取的开销与图元数无关，只有ID表需要解码，
+    访问到的页才从磁盘读入；之后对场景的修改不会写回快照文件
+
+    :param path: (string) 快照路径
+    :param mmap: (bool) 是否用numpy.memmap映射数组，False时全部读入内存
+    :return: (Snapshot) 场景、画布宽度、画布高度、画笔颜色、快照对应的指令行号和指令文件中的位置，以及待处理变换
+    """
+    with open(path, 'rb') as fp:
+        header = fp.read(_HEADER.size)
+        if len(header) < _HEADER.size or header[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            raise ValueError('not a scene snapshot: %s' % path)
+        (_, version, width, height, lineno, r, g, b,
+         n_items, n_points, id_nbytes, algorithm_nbytes, n_pending, instruction_offset) = _HEADER.unpack(header)
+        if version != SNAPSHOT_VERSION:
+            raise ValueError('unsupported scene snapshot version: %d' % version)
+        id_table = fp.read(id_nbytes).decode('utf-8')
+        fp.seek(_padding(id_nbytes), os.SEEK_CUR)
+        algorithm_table = fp.read(algorithm_nbytes).decode('utf-8')
+        offset = fp.seek(_padding(algorithm_nbytes), os.SEEK_CUR)
+
+    sections = _array_sections(n_items, n_points, n_pending)
+    size = offset
+    for _, dtype, shape in sections:
+        nbytes = np.dtype(dtype).itemsize * int(np.prod(shape))
+        size += nbytes + _padding(nbytes)
+    if os.path.getsize(path) < size:
+        raise ValueError('truncated scene snapshot: %s' % path)
+
+    scene = SceneStore()
+    arrays = {}
+    for name, dtype, shape in sections:
+        count = int(np.prod(shape))
+        if mmap and count > 0:
+            data = np.asarray(np.memmap(path, dtype, 'c', offset, shape))
+        else:
+            data = np.fromfile(path, dtype, count, offset=offset).reshape(shape)
+        arrays[name] = data
+        offset += data.nbytes + _padding(data.nbytes)
+    for name in ('type_codes', 'algorithm_codes', 'colors', 'starts', 'counts', 'points'):
+        setattr(scene, name, arrays[name])
+    scene.slot_ids = id_table.split('\n') if n_items else []
+    scene.slots = dict(zip(scene.slot_ids, range(n_items)))
+    scene.points_used = scene.points_live = n_points
+    scene.algorithms = algorithm_table.split('\n')
+    scene.algorithm_index = {name: i for i, name in enumerate(scene.algorithms)}
+    pending_transforms = {scene.slot_ids[slot]: np.array(matrix) for slot, matrix in
+                          zip(arrays['pending_items'].tolist(), arrays['pending_matrices'])}
+    return Snapshot(scene, width, height, np.array((r, g, b), np.uint8), lineno, instruction_offset,
+                    pending_transforms)